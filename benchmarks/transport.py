@@ -0,0 +1,76 @@
+"""
+Compare the `requests` transport with `HttpTransport` on the `set_state` path, against a local stand-in bridge.
+
+    python benchmarks/transport.py [number of lights] [rounds]
+"""
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hue_api import HueApi
+from hue_api.lights import HueLight
+from hue_api.transport import HttpTransport, RequestsTransport
+
+
+class BridgeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_PUT(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        content = json.dumps([{'success': {self.path + key: value}} for key, value in body.items()]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_api(transport, url, num_lights):
+    api = HueApi(transport=transport)
+    api.lights = [HueLight(id, f'Light {id}', {'on': False, 'bri': 1}, url, transport)
+                  for id in range(1, num_lights + 1)]
+    return api
+
+
+def bench(name, run, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        run(i)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<40} {elapsed / rounds * 1000:8.2f} ms/round")
+
+
+def main():
+    num_lights = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BridgeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/api/bench/lights'
+    print(f"{num_lights} lights, {rounds} rounds")
+
+    requests_api = make_api(RequestsTransport(), url, num_lights)
+    bench("requests, one light at a time", lambda i: [light.set_brightness(i % 254 + 1) for light in requests_api.lights], rounds)
+    bench("requests, set_brightness on all", lambda i: requests_api.set_brightness(i % 254 + 1), rounds)
+
+    transport = HttpTransport()
+    http_api = make_api(transport, url, num_lights)
+    bench("HttpTransport, one light at a time", lambda i: [light.set_brightness(i % 254 + 1) for light in http_api.lights], rounds)
+    bench("HttpTransport, set_brightness on all", lambda i: http_api.set_brightness(i % 254 + 1), rounds)
+
+    transport.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import os
+import pickle
+import socket
+import struct
+import threading
+import time
+
+SSDP_ADDRESS = ('239.255.255.250', 1900)
+MDNS_ADDRESS = ('224.0.0.251', 5353)
+MDNS_SERVICE = '_hue._tcp.local'
+
+SSDP_REQUEST = (
+    "M-SEARCH * HTTP/1.1\r\n"
+    "HOST: 239.255.255.250:1900\r\n"
+    "MAN: \"ssdp:discover\"\r\n"
+    "MX: 1\r\n"
+    "ST: urn:schemas-upnp-org:device:basic:1\r\n"
+    "\r\n"
+).encode('ascii')
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def mdns_query(service=MDNS_SERVICE):
+    """
+    Build a DNS PTR query for `service`
+
+    Args:
+        service (str): Service name, e.g. `_hue._tcp.local`
+
+    Returns:
+        bytes: The query packet
+    """
+    header = struct.pack('>HHHHHH', 0, 0, 1, 0, 0, 0)
+    name = b''.join(bytes([len(label)]) + label.encode('ascii') for label in service.split('.')) + b'\x00'
+    return header + name + struct.pack('>HH', 12, 1)
+
+
+def _is_ssdp_bridge(data):
+    return b'IpBridge' in data or b'hue-bridgeid' in data.lower()
+
+
+def _is_mdns_bridge(data, service=MDNS_SERVICE):
+    # A response (QR bit set) that mentions the hue service
+    if len(data) < 12 or not data[2] & 0x80:
+        return False
+    name = b''.join(bytes([len(label)]) + label.encode('ascii') for label in service.split('.'))
+    return name in data
+
+
+def _probe(address, request, is_bridge, deadline, found, done):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        try:
+            sock.sendto(request, address)
+        except OSError:
+            return
+        while not done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            sock.settimeout(min(remaining, 0.1))
+            try:
+                data, (host, _) = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if is_bridge(data):
+                found(host)
+
+
+def discover_bridges(timeout=3.0, limit=None, use_cache=True, max_age=3600, cache_file=None,
+                     ssdp_address=SSDP_ADDRESS, mdns_address=MDNS_ADDRESS):
+    """
+    Find Hue bridges on the local network. SSDP and mDNS probes run at the same time,
+    and the whole search never takes longer than `timeout`.
+
+    Results are cached in memory and, if `cache_file` is given, on disk, so that repeated calls are instant.
+    Only complete searches are cached: a search cut short by `limit` may have missed bridges.
+
+    Args:
+        timeout (float, optional): Time budget for the whole search, in seconds. Defaults to 3.0.
+        limit (int, optional): Return as soon as this many bridges were found. Defaults to waiting for the full `timeout`.
+        use_cache (bool, optional): Return cached results younger than `max_age`. Defaults to True.
+        max_age (float, optional): Maximum age of cached results, in seconds. Defaults to 3600.
+        cache_file (str, optional): Pickle file to keep results in across processes. Defaults to memory only.
+        ssdp_address ((str, int), optional): Where to send the SSDP search. Defaults to the SSDP multicast group.
+        mdns_address ((str, int), optional): Where to send the mDNS query. Defaults to the mDNS multicast group.
+
+    Returns:
+        [str]: IP addresses of the bridges that answered, in the order they answered
+    """
+    key = (ssdp_address, mdns_address)
+    if use_cache:
+        cached = _load_cache(key, cache_file)
+        if cached is not None and time.time() - cached[0] <= max_age and cached[1]:
+            return list(cached[1][:limit])
+
+    bridges = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def found(host):
+        with lock:
+            if limit and len(bridges) >= limit:
+                return
+            if host not in bridges:
+                bridges.append(host)
+            if limit and len(bridges) >= limit:
+                done.set()
+
+    deadline = time.monotonic() + timeout
+    probes = [
+        (ssdp_address, SSDP_REQUEST, _is_ssdp_bridge),
+        (mdns_address, mdns_query(), _is_mdns_bridge),
+    ]
+    threads = [threading.Thread(target=_probe, args=(address, request, is_bridge, deadline, found, done), daemon=True)
+               for address, request, is_bridge in probes if address]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0) + 0.2)
+    done.set()
+
+    with lock:
+        result = list(bridges)
+    if result and not (limit and len(result) >= limit):
+        _save_cache(key, result, cache_file)
+    return result
+
+
+def clear_cache(cache_file=None):
+    """
+    Forget cached discovery results
+
+    Args:
+        cache_file (str, optional): Also remove this cache file
+    """
+    with _cache_lock:
+        _cache.clear()
+    if cache_file and os.path.exists(cache_file):
+        os.remove(cache_file)
+
+
+def _load_cache(key, cache_file):
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+    if cache_file:
+        try:
+            with open(cache_file, 'rb') as cached_file:
+                loaded = pickle.load(cached_file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        entry = loaded.get(key)
+        if entry is not None:
+            with _cache_lock:
+                _cache[key] = entry
+        return entry
+    return None
+
+
+def _save_cache(key, bridges, cache_file):
+    entry = (time.time(), tuple(bridges))
+    with _cache_lock:
+        _cache[key] = entry
+    if cache_file:
+        try:
+            with open(cache_file, 'rb') as cached_file:
+                cache = pickle.load(cached_file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            cache = {}
+        cache[key] = entry
+        with open(cache_file, 'wb') as pickle_file:
+            pickle.dump(cache, pickle_file)
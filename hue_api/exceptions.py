@@ -1,9 +1,26 @@
+import re
+
+
 class FailedToSetState(Exception):
     """
     There was an error updating state, usually because a paramter passed to the bridge was malformed or of the wrong type.
+
+    Attributes
+
+    - `type` (`int`): The bridge's error type, if it reported one
+    - `description` (`str`): The bridge's error description, if it reported one
+    - `address` (`str`): The address the bridge reported, e.g. `/lights/99/state`
     """
     msg = "There was an error updating state"
 
+    def __init__(self, type=None, description=None, address=None):
+        super().__init__(type, description, address)
+        self.type = type
+        self.description = description
+        self.address = address
+        if description:
+            self.msg = f"{self.msg}: {description}"
+
 class FailedToGetState(Exception):
     """
     Failed to fetch light state from the API
@@ -27,3 +44,105 @@ class DevicetypeException(Exception):
     The device at the provided IP address/URL can't be controlled via this API
     """
     msg = "Invalid devicetype"
+
+class FailedToSync(Exception):
+    """
+    The bridge rejected a rule, schedule or sensor definition while syncing
+    """
+    msg = "Failed to sync definition with the bridge"
+
+class BridgeNotFoundException(Exception):
+    """
+    No Hue Bridge answered the discovery probes on the local network
+    """
+    msg = "No Hue Bridge found"
+
+class FailedToSetAttribute(FailedToSetState):
+    """
+    The bridge rejected one attribute of a state change. The other attributes may have been applied.
+
+    Attributes
+
+    - `attribute` (`str`): The rejected attribute, e.g. `bri`
+    - `address` (`str`): The address the bridge reported, e.g. `/lights/1/state/bri`
+    - `type` (`int`): The bridge's error type
+    - `description` (`str`): The bridge's error description
+    """
+    msg = "Failed to set attribute"
+
+    def __init__(self, attribute, address=None, type=None, description=None):
+        super().__init__(type, description, address)
+        self.attribute = attribute
+        self.msg = f"Failed to set {attribute}: {description or FailedToSetAttribute.msg}"
+
+    @staticmethod
+    def from_error(error):
+        """
+        Build the exception matching an `error` entry of a bridge response.
+        Only errors about a single attribute, at `.../state/<attribute>` or `.../action/<attribute>`,
+        are attribute errors. Anything else, such as an unknown light or an unauthorized user, failed the whole request.
+
+        Args:
+            error (dict): The entry, e.g. `{'type': 201, 'address': '/lights/1/state/bri', 'description': '...'}`
+
+        Returns:
+            FailedToSetState: An instance of the most specific `FailedToSetAttribute` subclass for the error's type,
+            or a plain `FailedToSetState` when the error isn't about one attribute
+        """
+        address = error.get('address') or ''
+        match = ATTRIBUTE_ADDRESS.search(address)
+        if match is None:
+            return FailedToSetState(error.get('type'), error.get('description'), address)
+        exception_class = ATTRIBUTE_ERROR_TYPES.get(error.get('type'), FailedToSetAttribute)
+        return exception_class(match.group(1), address, error.get('type'), error.get('description'))
+
+class AttributeNotAvailable(FailedToSetAttribute):
+    """
+    The light doesn't support this attribute (bridge error type 6)
+    """
+
+class InvalidAttributeValue(FailedToSetAttribute):
+    """
+    The value is out of range or of the wrong type (bridge error type 7)
+    """
+
+class AttributeNotModifiable(FailedToSetAttribute):
+    """
+    The attribute is read-only (bridge error type 8)
+    """
+
+class DeviceIsOff(FailedToSetAttribute):
+    """
+    The attribute can't be changed while the light is off (bridge error type 201)
+    """
+
+ATTRIBUTE_ADDRESS = re.compile(r'/(?:state|action)/([^/]+)/?$')
+
+ATTRIBUTE_ERROR_TYPES = {
+    6: AttributeNotAvailable,
+    7: InvalidAttributeValue,
+    8: AttributeNotModifiable,
+    201: DeviceIsOff,
+}
+
+class FailedToSetAttributes(FailedToSetState):
+    """
+    The bridge rejected some of the attributes of a state change.
+
+    Attributes
+
+    - `errors` (`[FailedToSetAttribute]`): One error per rejected attribute
+    """
+    msg = "Failed to set some attributes"
+
+    def __init__(self, errors):
+        super().__init__()
+        self.args = (errors,)
+        self.errors = errors
+        self.msg = "; ".join(error.msg for error in errors)
+
+class FailedToReadSharedState(Exception):
+    """
+    The shared state file stayed in the middle of a write, usually because the publishing process died
+    """
+    msg = "Shared state is being written and no consistent copy was read"
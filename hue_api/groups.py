@@ -1,16 +1,27 @@
+import contextlib
+
+from hue_api.exceptions import FailedToSetState
+from hue_api.state import parse_state_results, raise_state_errors
+from hue_api.transport import RequestsTransport
+
+
 class HueGroup:
     """
-    Class that corresponds to a group of Hue Lights. 
+    Class that corresponds to a group of Hue Lights.
 
     Attributes:
     - `id` (`int`): Group's ID
     - `name` (`str`): Group's name
     - `lights` (`[HueLight]`): List of lights belonging to this group
+    - `group_url` (`str`): The url that corresponds to the group. Of the form `<bridge_url>/groups/<group.id>/`
+    - `transport` (`RequestsTransport` or `HttpTransport`): Transport used to talk to the bridge
     """
-    def __init__(self, id, name, lights):
+    def __init__(self, id, name, lights, base_url=None, transport=None):
         self.id = id
         self.name = name
         self.lights = lights
+        self.group_url = f"{base_url}/{id}/" if base_url else None
+        self.transport = transport or RequestsTransport()
 
     def __str__(self):
         num_lights = len(self.lights)
@@ -18,3 +29,38 @@ class HueGroup:
         for light in self.lights:
             result = result + "\n" + light.__str__()
         return result
+
+    def set_state(self, state, raise_errors=False):
+        """
+        Set the same state on every light in the group with a single request to the group's `action` endpoint.
+        The attributes that the bridge reports as applied are updated on each light in `self.lights`.
+
+        Every light in the group is locked, in id order, for the whole request, so writes to single lights
+        are serialised with the group write just like writes to the same light.
+
+        Args:
+            state (dict): Partial state, in the bridge's format (`on`, `bri`, `hue`, `sat`)
+            raise_errors (bool, optional): Raise instead of printing when something was rejected. Defaults to False.
+
+        Raises:
+            FailedToSetState: With `raise_errors`, the request failed. `FailedToSetAttributes` when only some attributes were rejected
+
+        Returns:
+            [FailedToSetState]: What the bridge rejected, one `FailedToSetAttribute` per attribute. Empty on success
+        """
+        action_url = self.group_url + "action/"
+        with contextlib.ExitStack() as stack:
+            for light in sorted(set(self.lights), key=lambda light: light.id):
+                stack.enter_context(light._lock)
+            response = self.transport.put(action_url, state)
+            if response.status_code >= 300:
+                errors = [FailedToSetState()]
+            else:
+                applied, errors = parse_state_results(state, response)
+                for light in self.lights:
+                    light.state = light.state.updated(applied)
+        if raise_errors:
+            raise_state_errors(errors)
+        for error in errors:
+            print(error.msg)
+        return errors
@@ -2,19 +2,30 @@ import colorsys
 import inspect
 import json
 import os
+import contextlib
 import pickle
+import time
 import uuid
 
-import requests as re
 import webcolors
 
 import hue_api
 from hue_api.lights import HueLight
 from hue_api.groups import HueGroup
 from hue_api.scene import HueScene
+from hue_api.snapshot import HueSnapshot
+from hue_api.rules import HueRule
+from hue_api.schedules import HueSchedule
+from hue_api.sensors import HueSensor
+from hue_api.sync import plan_sync
+from hue_api.transport import RequestsTransport
+from hue_api.discovery import discover_bridges
+from hue_api.singleflight import SingleFlight
 from hue_api.exceptions import (UninitializedException,
                                 ButtonNotPressedException,
-                                DevicetypeException)
+                                BridgeNotFoundException,
+                                DevicetypeException,
+                                FailedToSync)
 
 
 class HueApi:
@@ -32,13 +43,40 @@ class HueApi:
     - `groups` (`[HueGroup]`): List of `HueGroup`
     - `scenes` (`[HueScene]`): List of `HueScene`
     - `grouped_scenes` (`Dictionary[str, [HueScene]]`): Scene dict, grouped by scene name
+    - `rules` (`[HueRule]`): List of `HueRule`
+    - `schedules` (`[HueSchedule]`): List of `HueSchedule`
+    - `sensors` (`[HueSensor]`): List of `HueSensor`
+    - `transport` (`RequestsTransport` or `HttpTransport`): Transport used for every request to the bridge.
+    Pass `HttpTransport()` to the constructor for persistent, pipelined connections.
+    - `min_freshness_ms` (`int`): `fetch_*` calls within this many milliseconds of the previous one
+    reuse its result instead of asking the bridge again. Defaults to 0.
+
+    Thread safety
+
+    A single `HueApi` can be shared between threads without any extra locking:
+
+    - `lights`, `groups`, `scenes`, `grouped_scenes`, `rules`, `schedules` and `sensors` are never modified in place. The `fetch_*` methods build
+    new lists and then rebind the attribute, so a reader that grabbed one of them keeps a consistent snapshot.
+    Treat them as read-only. Each attribute is published on its own, so `scenes` and `grouped_scenes` may briefly come from different fetches.
+    - Concurrent calls to the same `fetch_*` method share a single request to the bridge and its result,
+    so there is never more than one of them in flight and an older response never overwrites a newer one.
+    Refresh hooks run in the thread that made the request, before the other callers get the result,
+    so a hook must not call the `fetch_*` method that triggered it.
+    - Writes to a light are serialised per light, and `HueLight.state` is replaced rather than mutated, see `HueLight`.
     """
 
-    def __init__(self):
+    def __init__(self, transport=None, min_freshness_ms=0):
+        self.transport = transport or RequestsTransport()
+        self.min_freshness_ms = min_freshness_ms
         self.lights = []
         self.groups = []
         self.scenes = []
         self.grouped_scenes = {}
+        self.rules = []
+        self.schedules = []
+        self.sensors = []
+        self._single_flight = SingleFlight()
+        self._refresh_hooks = []
 
     def load_existing(self, cache_file=None, *args, **kwargs):
         """
@@ -91,7 +129,7 @@ class HueApi:
         """
         url = f'http://{bridge_ip_address}/api'
         payload = {'devicetype': 'hue_cli'}
-        response = re.post(url, json=payload)
+        response = self.transport.post(url, payload)
         response = response.json()[0]
         error = response.get('error')
         if error:
@@ -104,6 +142,42 @@ class HueApi:
         self.bridge_ip_address = bridge_ip_address
         self.base_url = f'http://{bridge_ip_address}/api/{user_name}'
 
+    def pair(self, bridge_ip_address=None, timeout=30.0, interval=0.5, max_interval=4.0, *args, **kwargs):
+        """
+        Create a new API user, waiting for the link button on the bridge to be pressed.
+        `create_new_user` is retried with exponential backoff until it succeeds or `timeout` runs out.
+
+        If no `bridge_ip_address` is provided, the first bridge found by `hue_api.discovery.discover_bridges` is used.
+
+        Args:
+            bridge_ip_address (str, optional): The IP Address for the Hue Bridge. Defaults to discovering it.
+            timeout (float, optional): How long to wait for the link button, in seconds. Defaults to 30.0.
+            interval (float, optional): Delay before the first retry, in seconds. Defaults to 0.5.
+            max_interval (float, optional): Longest delay between retries, in seconds. Defaults to 4.0.
+
+        Raises:
+            BridgeNotFoundException: no bridge was discovered on the local network
+
+            DevicetypeException: the Hue Bridge at the given address does not support interfacing via this API.
+
+            ButtonNotPressedException: the link button wasn't pressed before `timeout`
+        """
+        deadline = time.monotonic() + timeout
+        if not bridge_ip_address:
+            bridges = discover_bridges(limit=1)
+            if not bridges:
+                raise BridgeNotFoundException
+            bridge_ip_address = bridges[0]
+        while True:
+            try:
+                return self.create_new_user(bridge_ip_address)
+            except ButtonNotPressedException:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, max_interval)
+
     def save_api_key(self, cache_file=None, *args, **kwargs):
         """
         Save the API key (username) to a cache file.
@@ -126,15 +200,19 @@ class HueApi:
         Returns:
             [HueLight]: List of available lights. Also saved to `self.lights`
         """
+        return self._fetch_once('lights', self._fetch_lights)
+
+    def _fetch_lights(self):
         url = self.base_url + "/lights"
-        response = re.get(url).json()
+        response = self.transport.get(url).json()
         lights = []
         for id in response:
             state = response[id].get('state')
             name = response[id].get('name')
-            hue_light = HueLight(int(id), name, state, url)
+            hue_light = HueLight(int(id), name, state, url, self.transport)
             lights.append(hue_light)
         self.lights = lights
+        self._run_refresh_hooks('lights', lights)
         return lights
 
     def fetch_groups(self, *args, **kwargs):
@@ -144,15 +222,19 @@ class HueApi:
         Returns:
             [HueGroup]: List of available groups. Also saved to `self.groups`
         """
+        return self._fetch_once('groups', self._fetch_groups)
+
+    def _fetch_groups(self):
         url = self.base_url + "/groups"
-        response = re.get(url).json()
+        response = self.transport.get(url).json()
         groups = []
         for id in response:
             group_name = response[id].get('name')
             lights = [int(light) for light in response[id].get('lights')]
             group_lights = self.filter_lights(lights)
-            groups.append(HueGroup(id, group_name, group_lights))
+            groups.append(HueGroup(id, group_name, group_lights, url, self.transport))
         self.groups = groups
+        self._run_refresh_hooks('groups', groups)
         return groups
 
     def fetch_scenes(self, *args, **kwargs):
@@ -162,8 +244,11 @@ class HueApi:
         Returns:
             [HueScene]: List of available groups. Also saved to `self.scenes`
         """
+        return self._fetch_once('scenes', self._fetch_scenes)
+
+    def _fetch_scenes(self):
         url = self.base_url + "/scenes"
-        response = re.get(url).json()
+        response = self.transport.get(url).json()
         scenes = []
         for id in response:
             scene_name = response[id].get('name')
@@ -172,8 +257,197 @@ class HueApi:
             scenes.append(HueScene(id, scene_name, scene_lights))
         self.scenes = scenes
         self.grouped_scenes = HueScene.group_scenes(scenes)
+        self._run_refresh_hooks('scenes', scenes)
         return scenes
 
+    def _fetch_once(self, kind, fetch):
+        # Concurrent fetches of the same kind share one request, see `min_freshness_ms`
+        return self._single_flight.do(kind, fetch, self.min_freshness_ms / 1000)
+
+    def add_refresh_hook(self, hook):
+        """
+        Register a function that is called with `(kind, items)` every time lights, groups or scenes are fetched,
+        where `kind` is `'lights'`, `'groups'` or `'scenes'` and `items` is the new list.
+        See `hue_api.recorder.StateRecorder` for an example.
+
+        Args:
+            hook (callable): The function to call
+        """
+        self._refresh_hooks = self._refresh_hooks + [hook]
+
+    def remove_refresh_hook(self, hook):
+        """
+        Unregister a function added with `add_refresh_hook`
+
+        Args:
+            hook (callable): The function to remove
+        """
+        self._refresh_hooks = [registered for registered in self._refresh_hooks if registered is not hook]
+
+    def _run_refresh_hooks(self, kind, items):
+        for hook in self._refresh_hooks:
+            hook(kind, items)
+
+    def fetch_rules(self, *args, **kwargs):
+        """
+        Fetch the rules defined on the bridge
+
+        Returns:
+            [HueRule]: List of rules. Also saved to `self.rules`
+        """
+        return self._fetch_definitions(HueRule, 'rules')
+
+    def fetch_schedules(self, *args, **kwargs):
+        """
+        Fetch the schedules defined on the bridge
+
+        Returns:
+            [HueSchedule]: List of schedules. Also saved to `self.schedules`
+        """
+        return self._fetch_definitions(HueSchedule, 'schedules')
+
+    def fetch_sensors(self, *args, **kwargs):
+        """
+        Fetch the sensors known to the bridge
+
+        Returns:
+            [HueSensor]: List of sensors. Also saved to `self.sensors`
+        """
+        return self._fetch_definitions(HueSensor, 'sensors')
+
+    def _fetch_definitions(self, definition_class, attribute):
+        def fetch():
+            url = f"{self.base_url}/{definition_class.resource}"
+            response = self.transport.get(url).json()
+            definitions = [definition_class.from_dict(id, response[id]) for id in response]
+            setattr(self, attribute, definitions)
+            return definitions
+        return self._fetch_once(definition_class.resource, fetch)
+
+    # Bridge-side automation
+
+    def diff_rules(self, rules, delete_missing=False):
+        """
+        Compare local rule definitions with `self.rules`, matching them by name. Nothing is sent to the bridge.
+
+        Args:
+            rules ([HueRule]): Local rule definitions
+            delete_missing (bool, optional): Plan to delete bridge rules that aren't in `rules`. Defaults to False.
+
+        Returns:
+            SyncPlan: The rules to create, update and delete
+        """
+        return plan_sync(self.rules, rules, delete_missing)
+
+    def diff_schedules(self, schedules, delete_missing=False):
+        """
+        Compare local schedule definitions with `self.schedules`, matching them by name. Nothing is sent to the bridge.
+
+        Args:
+            schedules ([HueSchedule]): Local schedule definitions
+            delete_missing (bool, optional): Plan to delete bridge schedules that aren't in `schedules`. Defaults to False.
+
+        Returns:
+            SyncPlan: The schedules to create, update and delete
+        """
+        return plan_sync(self.schedules, schedules, delete_missing)
+
+    def diff_sensors(self, sensors, delete_missing=False):
+        """
+        Compare local sensor definitions with `self.sensors`, matching them by name. Nothing is sent to the bridge.
+
+        Args:
+            sensors ([HueSensor]): Local sensor definitions
+            delete_missing (bool, optional): Plan to delete bridge sensors that aren't in `sensors`. Defaults to False.
+
+        Returns:
+            SyncPlan: The sensors to create, update and delete
+        """
+        return plan_sync(self.sensors, sensors, delete_missing)
+
+    def sync_rules(self, rules, delete_missing=False):
+        """
+        Fetch the bridge's rules and push only the definitions that changed.
+        Running it again with the same definitions doesn't send anything.
+
+        Args:
+            rules ([HueRule]): Local rule definitions. Their `id` is set to the bridge's id
+            delete_missing (bool, optional): Delete bridge rules that aren't in `rules`. Defaults to False.
+
+        Raises:
+            FailedToSync: The bridge rejected one of the definitions
+
+        Returns:
+            SyncPlan: The changes that were applied
+        """
+        plan = plan_sync(self.fetch_rules(), rules, delete_missing)
+        self._apply_sync_plan(HueRule, plan)
+        return plan
+
+    def sync_schedules(self, schedules, delete_missing=False):
+        """
+        Fetch the bridge's schedules and push only the definitions that changed.
+        Running it again with the same definitions doesn't send anything.
+
+        Args:
+            schedules ([HueSchedule]): Local schedule definitions. Their `id` is set to the bridge's id
+            delete_missing (bool, optional): Delete bridge schedules that aren't in `schedules`. Defaults to False.
+
+        Raises:
+            FailedToSync: The bridge rejected one of the definitions
+
+        Returns:
+            SyncPlan: The changes that were applied
+        """
+        plan = plan_sync(self.fetch_schedules(), schedules, delete_missing)
+        self._apply_sync_plan(HueSchedule, plan)
+        return plan
+
+    def sync_sensors(self, sensors, delete_missing=False):
+        """
+        Fetch the bridge's sensors, create the missing ones and update the name and config of the others.
+        Sync sensors before the rules that refer to them, so that their ids are known.
+
+        Args:
+            sensors ([HueSensor]): Local sensor definitions. Their `id` is set to the bridge's id
+            delete_missing (bool, optional): Delete bridge sensors that aren't in `sensors`. Defaults to False.
+
+        Raises:
+            FailedToSync: The bridge rejected one of the definitions
+
+        Returns:
+            SyncPlan: The changes that were applied
+        """
+        plan = plan_sync(self.fetch_sensors(), sensors, delete_missing)
+        self._apply_sync_plan(HueSensor, plan)
+        return plan
+
+    def _apply_sync_plan(self, definition_class, plan):
+        url = f"{self.base_url}/{definition_class.resource}"
+        try:
+            for definition in plan.create:
+                result = self._check_sync_response(self.transport.post(url, definition.to_payload()))
+                definition.id = result[0]['success']['id']
+            for definition, updates in plan.update:
+                for path, body in updates.items():
+                    update_url = f"{url}/{definition.id}/{path}".rstrip('/')
+                    self._check_sync_response(self.transport.put(update_url, body))
+            for definition in plan.delete:
+                self._check_sync_response(self.transport.delete(f"{url}/{definition.id}"))
+        finally:
+            # The next fetch must see our changes, even within `min_freshness_ms`
+            if plan:
+                self._single_flight.forget(definition_class.resource)
+
+    @staticmethod
+    def _check_sync_response(response):
+        if response.status_code >= 300:
+            raise FailedToSync
+        result = response.json()
+        if any('error' in item for item in result):
+            raise FailedToSync
+        return result
+
     def print_debug_info(self, *args, **kwargs):
         """
         Print some debug info about bridge.
@@ -223,12 +497,109 @@ class HueApi:
         Returns:
             [HueLight]: List of lights whose ids match `indices`
         """
+        lights = self.lights
         if not indices:
-            return self.lights
-        return [light for light in self.lights if light.id in indices]
+            return lights
+        return [light for light in lights if light.id in indices]
+
+    # Snapshots
+
+    def snapshot(self, indices=[]):
+        """
+        Capture the current state of the lights whose ids are provided, from `self.lights`.
+        No request is made to the bridge; call `fetch_lights` first for an up to date capture.
+
+        Args:
+            indices ([int], optional): Ids of the lights to capture. Defaults to [] (all lights).
+
+        Returns:
+            HueSnapshot: Immutable capture that can be passed to `restore`
+        """
+        return HueSnapshot({light.id: light.state.to_payload() for light in self.filter_lights(indices)})
+
+    def restore(self, snapshot):
+        """
+        Bring the lights back to the state captured in `snapshot`, using as few requests as possible.
+
+        Only the attributes that differ from the current state in `self.lights` are sent.
+        Lights that need the exact same change are merged into a single group command when
+        they match an existing group in `self.groups` (or all of the lights), otherwise each light gets its own command.
+
+        Args:
+            snapshot (HueSnapshot): State previously captured with `snapshot`
+
+        Returns:
+            [(HueLight or HueGroup, dict)]: The commands that were sent, with their payloads
+        """
+        lights = {light.id: light for light in self.lights}
+        pending = {}
+        for id, target in snapshot:
+            light = lights.get(id)
+            if light is None:
+                continue
+            changes = HueSnapshot.changes(light.state.to_payload(), target)
+            if changes:
+                key = tuple(sorted(changes.items(), key=lambda item: item[0]))
+                pending.setdefault(key, []).append(light)
+
+        commands = []
+        light_commands = []
+        for key, members in pending.items():
+            payload = dict(key)
+            group = self._find_group(members, lights)
+            if group is not None:
+                group.set_state(payload)
+                commands.append((group, payload))
+            else:
+                light_commands += [(light, payload) for light in members]
+        self._set_states(light_commands)
+        return commands + light_commands
+
+    def _find_group(self, members, lights):
+        # A bridge group (or group 0, all lights) whose lights are exactly `members`
+        if len(members) < 2 or not hasattr(self, 'base_url'):
+            return None
+        ids = set(light.id for light in members)
+        groups_url = self.base_url + "/groups"
+        if ids == set(lights):
+            return HueGroup(0, 'All lights', members, groups_url, self.transport)
+        for group in self.groups:
+            if set(light.id for light in group.lights) == ids:
+                return HueGroup(group.id, group.name, members, groups_url, self.transport)
+        return None
 
     # Lights State Control
 
+    def _set_states(self, commands):
+        """
+        Send a state change to several lights at once. The requests go through `self.transport.put_many`,
+        so they are pipelined when the transport supports it.
+
+        Args:
+            commands ([(HueLight, dict)]): Lights and the partial state to set on each of them.
+            The payload can also be a function of the light's current `LightState`, evaluated while the light is locked.
+
+        Returns:
+            dict[int, [FailedToSetState]]: What the bridge rejected, by light id. Empty on success
+        """
+        if not commands:
+            return {}
+        with contextlib.ExitStack() as stack:
+            for light in sorted(set(light for light, _ in commands), key=lambda light: light.id):
+                stack.enter_context(light._lock)
+            commands = [(light, payload(light.state) if callable(payload) else payload)
+                        for light, payload in commands]
+            responses = self.transport.put_many([(light.state_url, payload) for light, payload in commands])
+            errors = {}
+            for (light, payload), response in zip(commands, responses):
+                light_errors = light._apply_response(payload, response)
+                if light_errors:
+                    errors[light.id] = light_errors
+        for light_errors in errors.values():
+            for error in light_errors:
+                print(error.msg)
+        return errors
+
     def turn_on(self, indices=[]):
         """
         Turn on only those lights whose ids are provided
@@ -236,8 +607,7 @@ class HueApi:
         Args:
             indices ([int], optional): Indices for the lights we want to turn on. Defaults to [].
         """
-        for light in self.filter_lights(indices):
-            light.set_on()
+        self._set_states([(light, {'on': True}) for light in self.filter_lights(indices)])
 
     def turn_off(self, indices=[]):
         """
@@ -246,8 +616,7 @@ class HueApi:
         Args:
             indices ([int], optional): Indices for the lights we want to turn off. Defaults to [].
         """
-        for light in self.filter_lights(indices):
-            light.set_off()
+        self._set_states([(light, {'on': False}) for light in self.filter_lights(indices)])
 
     def toggle_on(self, indices=[]):
         """
@@ -256,8 +625,7 @@ class HueApi:
         Args:
             indices ([int], optional): Indices for the lights we want to toggle. Defaults to [].
         """
-        for light in self.filter_lights(indices):
-            light.toggle_on()
+        self._set_states([(light, lambda state: {'on': not state.is_on}) for light in self.filter_lights(indices)])
 
     def set_brightness(self, brightness, indices=[]):
         """
@@ -283,8 +651,7 @@ class HueApi:
             if brightness <= 1.0:
                 brightness *= 254
             brightness = int(brightness)
-        for light in self.filter_lights(indices):
-            light.set_brightness(brightness)
+        self._set_states([(light, {'bri': brightness}) for light in self.filter_lights(indices)])
 
     def set_color(self, color, indices=[]):
         """
@@ -304,5 +671,4 @@ class HueApi:
         h, s, _ = colorsys.rgb_to_hsv(r, g, b)
         hue = int((2**16 - 1) * h)
         saturation = int((2**8 - 1) * s)
-        for light in self.filter_lights(indices):
-            light.set_color(hue, saturation)
+        self._set_states([(light, {'hue': hue, 'sat': saturation}) for light in self.filter_lights(indices)])
@@ -1,30 +1,41 @@
 import colorsys
-import requests as re
+import threading
 
-from hue_api.exceptions import FailedToGetState, FailedToSetState
-from hue_api.state import LightState
+from hue_api.exceptions import (FailedToGetState,
+                                FailedToSetState)
+from hue_api.state import LightState, parse_state_results, raise_state_errors
+from hue_api.transport import RequestsTransport
 
 class HueLight:
     """Individually controllable Hue Light
 
     Raises:
         FailedToSetState: When `self.set_state` fails, usually due to a bad parameter that the Hue API doesn't support.
+        Errors are printed unless `set_state` is called with `raise_errors=True`.
 
     Attributes
     
     - `id` (`int`): Light ID
     - `name` (`str`): Light's name
     - `light_url` (`str`): The url that corresponds to the light. Of the form `<bridge_url>/<light.id>`
+    - `state_url` (`str`): The url that state changes are sent to. Of the form `<light_url>/state/`
+    - `transport` (`RequestsTransport` or `HttpTransport`): Transport used to talk to the bridge
     - `state` (`LightState`): The reactive light state. This shouldn't be used directly.
+
+    Writes to a light are serialised by a per-light lock, and `state` is swapped for a new `LightState`
+    once the bridge accepted the change, so reading `state` never needs a lock.
     """
 
     # Public methods
 
-    def __init__(self, id, name, state_dict, base_url):
+    def __init__(self, id, name, state_dict, base_url, transport=None):
         self.id = id
         self.name = name
         self.light_url = f"{base_url}/{id}/"
+        self.state_url = self.light_url + "state/"
+        self.transport = transport or RequestsTransport()
         self.state = LightState(state_dict, bind_to=self)
+        self._lock = threading.RLock()
 
     def __str__(self):
         string = f"{self.id} - {self.name}"
@@ -38,7 +49,8 @@ class HueLight:
         """
         Toggle the on/off state of the light
         """
-        self.state.is_on = not self.state.is_on
+        with self._lock:
+            self.state.is_on = not self.state.is_on
 
     def set_on(self):
         """
@@ -71,17 +83,38 @@ class HueLight:
     # Private methods
 
     # This is the reactive binding that gets called when a state value changes
-    def set_state(self, state):
+    def set_state(self, state, raise_errors=False):
         """
         Set a new state for the light. This is an internal method and uses the HueState object.
         Don't use this directly.
+
+        Only the attributes that the bridge reports as applied are updated in `self.state`.
+
+        Args:
+            state (dict): Partial state, in the bridge's format (`on`, `bri`, `hue`, `sat`)
+            raise_errors (bool, optional): Raise instead of printing when something was rejected. Defaults to False.
+
+        Raises:
+            FailedToSetState: With `raise_errors`, the request failed. `FailedToSetAttributes` when only some attributes were rejected
+
+        Returns:
+            [FailedToSetState]: What the bridge rejected, one `FailedToSetAttribute` per attribute. Empty on success
         """
-        try:
-            state_url = self.light_url + "state/"
-            response = re.put(state_url, json=state)
-            status_code = response.status_code
-            if status_code >= 300:
-                raise FailedToSetState
-            self.state = LightState(state, bind_to=self)
-        except FailedToSetState as e:
-            print(e.msg)
+        with self._lock:
+            response = self.transport.put(self.state_url, state)
+            errors = self._apply_response(state, response)
+        if raise_errors:
+            raise_state_errors(errors)
+        for error in errors:
+            print(error.msg)
+        return errors
+
+    def _apply_response(self, state, response):
+        # Update the local state from the bridge's response to a `state` PUT, and return the errors.
+        # Callers hold `self._lock`
+        if response.status_code >= 300:
+            return [FailedToSetState()]
+        applied, errors = parse_state_results(state, response)
+        if applied:
+            self.state = self.state.updated(applied)
+        return errors
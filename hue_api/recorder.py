@@ -0,0 +1,237 @@
+import csv
+import math
+import struct
+import threading
+import time
+from array import array
+
+ATTRIBUTES = ('on', 'bri', 'hue', 'sat', 'reachable')
+BOOLEAN_ATTRIBUTES = ('on', 'reachable')
+
+BINARY_MAGIC = b'HUEREC'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<6sBI')
+BINARY_RECORD = struct.Struct('<IBdd')
+
+
+class _Ring:
+    """
+    Fixed-size ring buffer of `(timestamp, value)` samples, backed by two `array('d')`.
+    Only changes are stored: appending the same value as the last sample is a no-op.
+    """
+    __slots__ = ('times', 'values', 'start', 'count')
+
+    def __init__(self, capacity):
+        self.times = array('d', [0.0]) * capacity
+        self.values = array('d', [0.0]) * capacity
+        self.start = 0
+        self.count = 0
+
+    def _index(self, i):
+        return (self.start + i) % len(self.times)
+
+    def append(self, timestamp, value):
+        if self.count:
+            last = self.values[self._index(self.count - 1)]
+            if last == value or (math.isnan(last) and math.isnan(value)):
+                return
+        if self.count < len(self.times):
+            index = self._index(self.count)
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % len(self.times)
+        self.times[index] = timestamp
+        self.values[index] = value
+
+    def _bisect(self, timestamp):
+        # Number of samples with a time <= timestamp
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._index(middle)] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def samples(self, start=None, end=None):
+        first = 0 if start is None else max(self._bisect(start) - 1, 0)
+        last = self.count if end is None else self._bisect(end)
+        for i in range(first, last):
+            index = self._index(i)
+            yield self.times[index], self.values[index]
+
+
+class StateRecorder:
+    """
+    Records the state of every light over time, in memory, without keeping `LightState` objects around.
+
+    Each light attribute gets a fixed-size ring buffer of `capacity` samples. A sample is only stored when the value
+    changed since the previous refresh, so lights that don't change cost nothing. Once a buffer is full the oldest
+    samples are dropped.
+
+    Attach it to a `HueApi` and it records on every `fetch_lights`:
+    ```
+    recorder = StateRecorder()
+    recorder.attach(api)
+    ```
+
+    Attributes
+
+    - `capacity` (`int`): Maximum number of samples kept per light attribute
+    - `attributes` (`(str)`): Attributes recorded, out of `ATTRIBUTES`
+    """
+
+    def __init__(self, capacity=1024, attributes=ATTRIBUTES):
+        self.capacity = capacity
+        self.attributes = tuple(attributes)
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def attach(self, api):
+        """
+        Record lights every time `api.fetch_lights` runs
+
+        Args:
+            api (HueApi): The api to record
+        """
+        api.add_refresh_hook(self.on_refresh)
+
+    def on_refresh(self, kind, items):
+        """
+        Refresh hook, see `HueApi.add_refresh_hook`. Only light refreshes are recorded.
+        """
+        if kind == 'lights':
+            self.record(items)
+
+    def record(self, lights, timestamp=None):
+        """
+        Record the current state of `lights`
+
+        Args:
+            lights ([HueLight]): Lights to record
+            timestamp (float, optional): Unix time of the sample. Defaults to `time.time()`.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for light in lights:
+                state = light.state
+                values = state.to_payload()
+                values['reachable'] = state.reachable
+                for attribute in self.attributes:
+                    key = (light.id, attribute)
+                    ring = self._rings.get(key)
+                    if ring is None:
+                        ring = self._rings[key] = _Ring(self.capacity)
+                    ring.append(timestamp, self._encode(values.get(attribute)))
+
+    def samples(self, light_id, attribute, start=None, end=None):
+        """
+        Recorded changes of one attribute of a light, oldest first.
+
+        Since only changes are stored, the first sample returned is the one in effect at `start`,
+        and may be older than `start`.
+
+        Args:
+            light_id (int): Light id
+            attribute (str): One of `self.attributes`
+            start (float, optional): Unix time of the start of the range. Defaults to the oldest sample.
+            end (float, optional): Unix time of the end of the range, inclusive. Defaults to the newest sample.
+
+        Returns:
+            [(float, value)]: Timestamps and values. Values are `bool` for `on` and `reachable`, `int` otherwise, and `None` when unknown
+        """
+        with self._lock:
+            ring = self._rings.get((light_id, attribute))
+            if ring is None:
+                return []
+            return [(timestamp, self._decode(attribute, value))
+                    for timestamp, value in ring.samples(start, end)]
+
+    def value_at(self, light_id, attribute, timestamp):
+        """
+        Value of one attribute of a light at a given time
+
+        Returns:
+            The recorded value, or `None` if nothing was recorded before `timestamp`
+        """
+        samples = self.samples(light_id, attribute, timestamp, timestamp)
+        if not samples:
+            return None
+        return samples[0][1]
+
+    def export_csv(self, path, start=None, end=None):
+        """
+        Export recorded samples to a CSV file with a `light_id,attribute,timestamp,value` header
+
+        Args:
+            path (str): Path to the file
+            start (float, optional): Only export samples in effect from this Unix time
+            end (float, optional): Only export samples up to this Unix time
+        """
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['light_id', 'attribute', 'timestamp', 'value'])
+            for light_id, attribute, timestamp, value in self._export(start, end):
+                writer.writerow([light_id, attribute, repr(timestamp), '' if value is None else value])
+
+    def export_binary(self, path, start=None, end=None):
+        """
+        Export recorded samples to a compact binary file.
+
+        The file is a `BINARY_HEADER` (magic, version, record count) followed by `BINARY_RECORD`s
+        (light id, index of the attribute in `ATTRIBUTES`, timestamp, value as a double, NaN when unknown).
+        Read it back with `StateRecorder.read_binary`.
+
+        Args:
+            path (str): Path to the file
+            start (float, optional): Only export samples in effect from this Unix time
+            end (float, optional): Only export samples up to this Unix time
+        """
+        records = [BINARY_RECORD.pack(light_id, ATTRIBUTES.index(attribute), timestamp, self._encode(value))
+                   for light_id, attribute, timestamp, value in self._export(start, end)]
+        with open(path, 'wb') as binary_file:
+            binary_file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(records)))
+            binary_file.write(b''.join(records))
+
+    @staticmethod
+    def read_binary(path):
+        """
+        Read a file written by `export_binary`
+
+        Returns:
+            [(int, str, float, value)]: Light id, attribute, timestamp and value of every sample
+        """
+        with open(path, 'rb') as binary_file:
+            data = binary_file.read()
+        magic, version, count = BINARY_HEADER.unpack_from(data)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError(f"{path} is not a state recorder export")
+        records = []
+        for offset in range(BINARY_HEADER.size, BINARY_HEADER.size + count * BINARY_RECORD.size, BINARY_RECORD.size):
+            light_id, attribute_index, timestamp, value = BINARY_RECORD.unpack_from(data, offset)
+            attribute = ATTRIBUTES[attribute_index]
+            records.append((light_id, attribute, timestamp, StateRecorder._decode(attribute, value)))
+        return records
+
+    def _export(self, start, end):
+        with self._lock:
+            keys = sorted(self._rings)
+        for light_id, attribute in keys:
+            for timestamp, value in self.samples(light_id, attribute, start, end):
+                yield light_id, attribute, timestamp, value
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return math.nan
+        return float(value)
+
+    @staticmethod
+    def _decode(attribute, value):
+        if math.isnan(value):
+            return None
+        if attribute in BOOLEAN_ATTRIBUTES:
+            return bool(value)
+        return int(value)
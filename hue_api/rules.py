@@ -0,0 +1,101 @@
+from collections import namedtuple
+
+
+class Condition(namedtuple('Condition', ['address', 'operator', 'value'])):
+    """
+    A rule condition, evaluated on the bridge.
+
+    Attributes
+
+    - `address` (`str`): Resource attribute to check, e.g. `/sensors/2/state/presence`
+    - `operator` (`str`): One of `eq`, `gt`, `lt`, `dx`, `ddx`, `stable`, `not stable`, `in`, `not in`
+    - `value` (`str`, optional): Value to compare against. Not used by `dx` and friends.
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        result = {'address': self.address, 'operator': self.operator}
+        if self.value is not None:
+            result['value'] = self.value
+        return result
+
+    @staticmethod
+    def from_dict(data):
+        return Condition(data.get('address'), data.get('operator'), data.get('value'))
+
+
+Condition.__new__.__defaults__ = (None,)
+
+
+class Action(namedtuple('Action', ['address', 'method', 'body'])):
+    """
+    A request executed by the bridge, used by rules and schedules.
+
+    Attributes
+
+    - `address` (`str`): Resource to call. `/groups/1/action` for rules, `/api/<user_name>/groups/1/action` for schedules
+    - `method` (`str`): HTTP method, usually `PUT`
+    - `body` (`dict`): Request body, e.g. `{'on': True}`
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        return {'address': self.address, 'method': self.method, 'body': self.body}
+
+    @staticmethod
+    def from_dict(data):
+        return Action(data.get('address'), data.get('method'), data.get('body'))
+
+
+class HueRule:
+    """
+    A rule that runs on the bridge: when all `conditions` are true, the bridge executes the `actions`.
+
+    Attributes
+
+    - `id` (`str`): Rule's ID. `None` until the rule exists on the bridge
+    - `name` (`str`): Rule's name, used to match local definitions to the bridge's when syncing
+    - `conditions` (`[Condition]`): Conditions that trigger the rule
+    - `actions` (`[Action]`): Actions executed when the rule triggers
+    - `status` (`str`): `enabled` or `disabled`
+    """
+    resource = 'rules'
+
+    def __init__(self, name, conditions, actions, status='enabled', id=None):
+        self.id = id
+        self.name = name
+        self.conditions = list(conditions)
+        self.actions = list(actions)
+        self.status = status
+
+    def __str__(self):
+        return f"Rule({self.id}) - {self.name} - {len(self.conditions)} conditions, {len(self.actions)} actions"
+
+    def to_payload(self):
+        return {
+            'name': self.name,
+            'conditions': [condition.to_dict() for condition in self.conditions],
+            'actions': [action.to_dict() for action in self.actions],
+            'status': self.status
+        }
+
+    def updates(self, current):
+        """
+        Requests needed to turn `current` into this definition.
+
+        Args:
+            current (HueRule): The rule as it is on the bridge
+
+        Returns:
+            dict[str, dict]: Request bodies, keyed by path relative to the rule's url. Empty if nothing changed
+        """
+        payload = self.to_payload()
+        if payload == current.to_payload():
+            return {}
+        return {'': payload}
+
+    @staticmethod
+    def from_dict(id, data):
+        conditions = [Condition.from_dict(condition) for condition in data.get('conditions', [])]
+        actions = [Action.from_dict(action) for action in data.get('actions', [])]
+        return HueRule(data.get('name'), conditions, actions, data.get('status', 'enabled'), id=id)
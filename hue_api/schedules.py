@@ -0,0 +1,67 @@
+from hue_api.rules import Action
+
+
+class HueSchedule:
+    """
+    A schedule that runs on the bridge: at `localtime`, the bridge executes `command`.
+
+    Attributes
+
+    - `id` (`str`): Schedule's ID. `None` until the schedule exists on the bridge
+    - `name` (`str`): Schedule's name, used to match local definitions to the bridge's when syncing
+    - `command` (`Action`): Action executed by the schedule. Its address must include `/api/<user_name>`
+    - `localtime` (`str`): Bridge time pattern, e.g. `W124/T07:30:00` or `PT00:10:00`
+    - `description` (`str`): Free text description
+    - `status` (`str`): `enabled` or `disabled`
+    - `autodelete` (`bool`): Whether the bridge deletes the schedule once it has run. `None` keeps the bridge's default
+    """
+    resource = 'schedules'
+
+    def __init__(self, name, command, localtime, description='', status='enabled', autodelete=None, id=None):
+        self.id = id
+        self.name = name
+        self.command = command
+        self.localtime = localtime
+        self.description = description
+        self.status = status
+        self.autodelete = autodelete
+
+    def __str__(self):
+        return f"Schedule({self.id}) - {self.name} - {self.localtime} ({self.status})"
+
+    def to_payload(self):
+        payload = {
+            'name': self.name,
+            'description': self.description,
+            'command': self.command.to_dict(),
+            'localtime': self.localtime,
+            'status': self.status
+        }
+        if self.autodelete is not None:
+            payload['autodelete'] = self.autodelete
+        return payload
+
+    def updates(self, current):
+        """
+        Requests needed to turn `current` into this definition.
+
+        Args:
+            current (HueSchedule): The schedule as it is on the bridge
+
+        Returns:
+            dict[str, dict]: Request bodies, keyed by path relative to the schedule's url. Empty if nothing changed
+        """
+        payload = self.to_payload()
+        current_payload = current.to_payload()
+        changed = {key: value for key, value in payload.items() if current_payload.get(key) != value}
+        return {'': changed} if changed else {}
+
+    @staticmethod
+    def from_dict(id, data):
+        command = Action.from_dict(data.get('command', {}))
+        localtime = data.get('localtime', data.get('time'))
+        return HueSchedule(data.get('name'), command, localtime,
+                           description=data.get('description', ''),
+                           status=data.get('status', 'enabled'),
+                           autodelete=data.get('autodelete'),
+                           id=id)
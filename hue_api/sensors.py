@@ -0,0 +1,73 @@
+class HueSensor:
+    """
+    A sensor known to the bridge. Physical sensors (motion, dimmer switches) are paired on the bridge,
+    CLIP sensors (e.g. `CLIPGenericStatus`) can be created through the API and used as state in rules.
+
+    Attributes
+
+    - `id` (`str`): Sensor's ID. `None` until the sensor exists on the bridge
+    - `name` (`str`): Sensor's name, used to match local definitions to the bridge's when syncing
+    - `type` (`str`): Sensor type, e.g. `ZLLPresence` or `CLIPGenericStatus`
+    - `model_id` (`str`): Model id
+    - `manufacturer_name` (`str`): Manufacturer name
+    - `sw_version` (`str`): Software version
+    - `unique_id` (`str`): Unique id
+    - `state` (`dict`): Sensor state, as reported by the bridge
+    - `config` (`dict`): Sensor config, e.g. `{'on': True}`
+    """
+    resource = 'sensors'
+
+    def __init__(self, name, type, model_id, manufacturer_name, sw_version, unique_id,
+                 state=None, config=None, id=None):
+        self.id = id
+        self.name = name
+        self.type = type
+        self.model_id = model_id
+        self.manufacturer_name = manufacturer_name
+        self.sw_version = sw_version
+        self.unique_id = unique_id
+        self.state = state or {}
+        self.config = config or {}
+
+    def __str__(self):
+        return f"Sensor({self.id}) - {self.name} - {self.type}"
+
+    def to_payload(self):
+        payload = {
+            'name': self.name,
+            'type': self.type,
+            'modelid': self.model_id,
+            'manufacturername': self.manufacturer_name,
+            'swversion': self.sw_version,
+            'uniqueid': self.unique_id
+        }
+        if self.state:
+            payload['state'] = self.state
+        if self.config:
+            payload['config'] = self.config
+        return payload
+
+    def updates(self, current):
+        """
+        Requests needed to turn `current` into this definition.
+        Only the name and config of a sensor can be changed; `state` is left to the sensor (or to rules).
+
+        Args:
+            current (HueSensor): The sensor as it is on the bridge
+
+        Returns:
+            dict[str, dict]: Request bodies, keyed by path relative to the sensor's url. Empty if nothing changed
+        """
+        updates = {}
+        if self.name != current.name:
+            updates[''] = {'name': self.name}
+        config = {key: value for key, value in self.config.items() if current.config.get(key) != value}
+        if config:
+            updates['config'] = config
+        return updates
+
+    @staticmethod
+    def from_dict(id, data):
+        return HueSensor(data.get('name'), data.get('type'), data.get('modelid'),
+                         data.get('manufacturername'), data.get('swversion'), data.get('uniqueid'),
+                         state=data.get('state'), config=data.get('config'), id=id)
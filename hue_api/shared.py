@@ -0,0 +1,265 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from hue_api.exceptions import FailedToReadSharedState
+
+MAGIC = b'HUES'
+VERSION = 1
+NAME_SIZE = 32
+MAX_GROUP_LIGHTS = 32
+
+# Layout of the shared file:
+# HEADER, SEQUENCE, STATE_HEADER, then `max_lights` LIGHT records and `max_groups` GROUP records
+HEADER = struct.Struct('<4sHHHH4x')
+SEQUENCE = struct.Struct('<Q')
+STATE_HEADER = struct.Struct('<dHHH2x')
+LIGHT = struct.Struct(f'<IHHHH{NAME_SIZE}s')
+GROUP = struct.Struct(f'<IH{NAME_SIZE}s{MAX_GROUP_LIGHTS}H')
+
+SEQUENCE_OFFSET = HEADER.size
+STATE_OFFSET = SEQUENCE_OFFSET + SEQUENCE.size
+LIGHTS_OFFSET = STATE_OFFSET + STATE_HEADER.size
+
+# LIGHT flags
+ON = 1
+REACHABLE = 2
+ON_KNOWN = 4
+REACHABLE_KNOWN = 8
+BRI_KNOWN = 16
+HUE_KNOWN = 32
+SAT_KNOWN = 64
+
+# STATE_HEADER flags, set when there was more to publish than the file has room for
+LIGHTS_TRUNCATED = 1
+GROUPS_TRUNCATED = 2
+GROUP_LIGHTS_TRUNCATED = 4
+
+SharedLight = namedtuple('SharedLight', ['id', 'name', 'on', 'reachable', 'bri', 'hue', 'sat'])
+SharedGroup = namedtuple('SharedGroup', ['id', 'name', 'light_ids'])
+SharedState = namedtuple('SharedState', ['sequence', 'timestamp', 'lights', 'groups', 'truncated'])
+
+
+def _size(max_lights, max_groups):
+    return LIGHTS_OFFSET + LIGHT.size * max_lights + GROUP.size * max_groups
+
+
+def _encode_name(name):
+    return (name or '').encode('utf-8')[:NAME_SIZE]
+
+
+def _decode_name(name):
+    return name.rstrip(b'\x00').decode('utf-8', errors='ignore')
+
+
+class SharedStatePublisher:
+    """
+    Publishes light and group state to a memory-mapped file, so that other processes can read it
+    with `SharedStateReader` instead of polling the bridge themselves.
+
+    One process owns the `HueApi` and attaches a publisher to it:
+    ```
+    publisher = SharedStatePublisher('/dev/shm/hue_state')
+    publisher.attach(api)
+    api.fetch_lights()
+    ```
+
+    The file has a fixed layout (see the structs at the top of this module). Names longer than
+    32 bytes are truncated, and groups keep their first 32 lights. Lights and groups that don't fit
+    in `max_lights`/`max_groups` are left out, and flagged in `SharedState.truncated`.
+    The defaults have room for as many lights and groups as a bridge supports.
+    Every publish bumps a sequence counter to an odd value, writes the records, then bumps it again to an even value,
+    so readers can tell when they raced with a write and retry.
+
+    Attributes
+
+    - `path` (`str`): Path to the shared file
+    - `max_lights` (`int`): Number of light records in the file
+    - `max_groups` (`int`): Number of group records in the file
+    """
+
+    def __init__(self, path, max_lights=64, max_groups=64):
+        self.path = path
+        self.max_lights = max_lights
+        self.max_groups = max_groups
+        self._lock = threading.Lock()
+        self._lights = []
+        self._groups = []
+        size = _size(max_lights, max_groups)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        # Keep the sequence moving forward across restarts, so attached readers don't mistake new data for old
+        sequence = SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0] | 1
+        SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, sequence)
+        self._map[STATE_OFFSET:size] = bytes(size - STATE_OFFSET)
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, max_lights, max_groups, MAX_GROUP_LIGHTS)
+        SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, sequence + 1)
+
+    def attach(self, api):
+        """
+        Publish every time `api.fetch_lights` or `api.fetch_groups` runs
+
+        Args:
+            api (HueApi): The api that owns the bridge connection
+        """
+        api.add_refresh_hook(self.on_refresh)
+
+    def on_refresh(self, kind, items):
+        """
+        Refresh hook, see `HueApi.add_refresh_hook`
+        """
+        if kind == 'lights':
+            self.publish(lights=items)
+        elif kind == 'groups':
+            self.publish(groups=items)
+
+    def publish(self, lights=None, groups=None):
+        """
+        Write lights and groups to the shared file
+
+        Args:
+            lights ([HueLight], optional): Lights to publish. Defaults to the lights published last.
+            groups ([HueGroup], optional): Groups to publish. Defaults to the groups published last.
+        """
+        with self._lock:
+            lights = self._lights if lights is None else list(lights)
+            groups = self._groups if groups is None else list(groups)
+            self._lights, self._groups = lights, groups
+            truncated = 0
+            if len(lights) > self.max_lights:
+                lights = lights[:self.max_lights]
+                truncated |= LIGHTS_TRUNCATED
+            if len(groups) > self.max_groups:
+                groups = groups[:self.max_groups]
+                truncated |= GROUPS_TRUNCATED
+            if any(len(group.lights) > MAX_GROUP_LIGHTS for group in groups):
+                truncated |= GROUP_LIGHTS_TRUNCATED
+            records = [self._pack_light(light) for light in lights]
+            records += [b'\x00' * LIGHT.size] * (self.max_lights - len(lights))
+            records += [self._pack_group(group) for group in groups]
+            body = STATE_HEADER.pack(time.time(), len(lights), len(groups), truncated) + b''.join(records)
+
+            sequence = SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+            SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, sequence + 1)
+            self._map[STATE_OFFSET:STATE_OFFSET + len(body)] = body
+            SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, sequence + 2)
+
+    def close(self):
+        self._map.close()
+
+    @staticmethod
+    def _pack_light(light):
+        state = light.state
+        flags = 0
+        if state.is_on is not None:
+            flags |= ON_KNOWN | (ON if state.is_on else 0)
+        if state.reachable is not None:
+            flags |= REACHABLE_KNOWN | (REACHABLE if state.reachable else 0)
+        values = []
+        for value, known in ((state.brightness, BRI_KNOWN), (state.hue, HUE_KNOWN), (state.saturation, SAT_KNOWN)):
+            if value is not None:
+                flags |= known
+            values.append(value or 0)
+        return LIGHT.pack(light.id, flags, *values, _encode_name(light.name))
+
+    @staticmethod
+    def _pack_group(group):
+        light_ids = [light.id for light in group.lights][:MAX_GROUP_LIGHTS]
+        padded = light_ids + [0] * (MAX_GROUP_LIGHTS - len(light_ids))
+        return GROUP.pack(int(group.id), len(light_ids), _encode_name(group.name), *padded)
+
+
+class SharedStateReader:
+    """
+    Reads the state published by a `SharedStatePublisher`, possibly from another process.
+    Reading never touches the network: records are unpacked straight from the memory-mapped file.
+
+    `read` retries until it gets a consistent view, and only unpacks the records again when the sequence counter moved.
+    If the publisher died in the middle of a write, `read` gives up after `timeout` seconds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as shared_file:
+            self._map = mmap.mmap(shared_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.max_lights, self.max_groups, max_group_lights = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or max_group_lights != MAX_GROUP_LIGHTS:
+            self._map.close()
+            raise ValueError(f"{path} is not a shared state file")
+        self._last = None
+
+    @property
+    def sequence(self):
+        """
+        Current value of the sequence counter. Even when no write is in progress, and it changes on every publish
+        """
+        return SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+
+    def read(self, timeout=1.0):
+        """
+        Consistent view of the published state
+
+        Args:
+            timeout (float, optional): How long to retry while a write is in progress, in seconds. Defaults to 1.0.
+
+        Raises:
+            FailedToReadSharedState: No consistent view could be read before `timeout`, and nothing was read before
+
+        Returns:
+            SharedState: Sequence number, publish time, `[SharedLight]`, `[SharedGroup]` and truncation flags.
+            The last consistent view if the file stays mid-write for longer than `timeout`
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sequence = self.sequence
+            if not sequence % 2:
+                if self._last is not None and self._last.sequence == sequence:
+                    return self._last
+                state = self._unpack(sequence)
+                if self.sequence == sequence:
+                    self._last = state
+                    return state
+            if time.monotonic() >= deadline:
+                if self._last is not None:
+                    return self._last
+                raise FailedToReadSharedState
+            time.sleep(0.0005)
+
+    def lights(self):
+        return self.read().lights
+
+    def groups(self):
+        return self.read().groups
+
+    def close(self):
+        self._map.close()
+
+    def _unpack(self, sequence):
+        timestamp, light_count, group_count, truncated = STATE_HEADER.unpack_from(self._map, STATE_OFFSET)
+        # A torn read can give garbage counts, the sequence check in `read` throws the result away
+        light_count = min(light_count, self.max_lights)
+        group_count = min(group_count, self.max_groups)
+        lights = []
+        for index in range(light_count):
+            id, flags, bri, hue, sat, name = LIGHT.unpack_from(self._map, LIGHTS_OFFSET + index * LIGHT.size)
+            lights.append(SharedLight(
+                id, _decode_name(name),
+                bool(flags & ON) if flags & ON_KNOWN else None,
+                bool(flags & REACHABLE) if flags & REACHABLE_KNOWN else None,
+                bri if flags & BRI_KNOWN else None,
+                hue if flags & HUE_KNOWN else None,
+                sat if flags & SAT_KNOWN else None))
+        groups = []
+        groups_offset = LIGHTS_OFFSET + self.max_lights * LIGHT.size
+        for index in range(group_count):
+            record = GROUP.unpack_from(self._map, groups_offset + index * GROUP.size)
+            id, count, name = record[:3]
+            groups.append(SharedGroup(str(id), _decode_name(name), list(record[3:3 + min(count, MAX_GROUP_LIGHTS)])))
+        return SharedState(sequence, timestamp, lights, groups, truncated)
@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one: the first caller runs the function,
+    the others wait for it and get the same result (or exception).
+
+    The last result for each key is also kept, so that calls within `max_age` seconds of it can reuse it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._results = {}
+
+    def do(self, key, function, max_age=0):
+        """
+        Call `function`, unless a call for `key` is already in flight or finished less than `max_age` seconds ago.
+
+        Args:
+            key (hashable): Identifies calls that can share a result
+            function (callable): Called without arguments
+            max_age (float, optional): How old a previous result may be to be reused, in seconds. Defaults to 0 (only share in-flight calls).
+
+        Returns:
+            The result of `function`
+        """
+        with self._lock:
+            if max_age > 0 and key in self._results:
+                finished, result = self._results[key]
+                if time.monotonic() - finished <= max_age:
+                    return result
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None:
+                    self._results[key] = (time.monotonic(), call.result)
+            call.done.set()
+        return call.result
+
+    def forget(self, key):
+        """
+        Drop the last result for `key`, so that the next call runs again
+        """
+        with self._lock:
+            self._results.pop(key, None)
@@ -0,0 +1,83 @@
+class HueSnapshot:
+    """
+    Immutable capture of the state of a set of lights, as returned by `HueApi.snapshot`.
+    Pass it to `HueApi.restore` to bring the lights back to the captured state.
+
+    The snapshot only holds plain ids and values, so it is cheap to keep around, compare, hash and pickle.
+    Attributes the bridge didn't report (`None`) are not captured and are left untouched on restore.
+    """
+    __slots__ = ('_states',)
+
+    def __init__(self, states):
+        """
+        Args:
+            states (dict[int, dict]): Light state payloads, keyed by light id
+        """
+        frozen = tuple(sorted(
+            (id, tuple(sorted(((key, value) for key, value in payload.items() if value is not None),
+                              key=lambda item: item[0])))
+            for id, payload in states.items()
+        ))
+        object.__setattr__(self, '_states', frozen)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("HueSnapshot is immutable")
+
+    def __reduce__(self):
+        return (HueSnapshot, ({id: dict(items) for id, items in self._states},))
+
+    def __iter__(self):
+        for id, items in self._states:
+            yield id, dict(items)
+
+    def __len__(self):
+        return len(self._states)
+
+    def __eq__(self, other):
+        return isinstance(other, HueSnapshot) and self._states == other._states
+
+    def __hash__(self):
+        return hash(self._states)
+
+    def __str__(self):
+        return f"Snapshot - {len(self)} lights"
+
+    @property
+    def light_ids(self):
+        return [id for id, _ in self._states]
+
+    def state_for(self, id):
+        """
+        Captured state for a single light
+
+        Args:
+            id (int): Light id
+
+        Returns:
+            dict: The captured payload, or `None` if the light isn't part of this snapshot
+        """
+        for light_id, items in self._states:
+            if light_id == id:
+                return dict(items)
+        return None
+
+    @staticmethod
+    def changes(current, target):
+        """
+        Internal method used to compute the smallest payload that takes a light from `current` to `target`.
+
+        Lights that should end up off get their differing attributes in the same command as `{'on': False}`,
+        so they come back with the captured brightness and color the next time they are turned on.
+        Lights that are already off are left alone, since the bridge won't accept other attributes for them.
+        Lights that are switched on get the remaining attributes in the same command.
+
+        Args:
+            current (dict): Current state payload of the light
+            target (dict): Target state payload of the light
+
+        Returns:
+            dict: Attributes that need to be sent. Empty if the light is already in the target state
+        """
+        if target.get('on') is False and current.get('on') is False:
+            return {}
+        return {key: value for key, value in target.items() if current.get(key) != value}
@@ -1,7 +1,69 @@
+from hue_api.exceptions import FailedToSetAttribute, FailedToSetAttributes
+
+
+def parse_state_results(state, response):
+    """
+    Split the bridge's response to a state change into the attributes that were applied and the ones that were rejected.
+
+    The bridge answers a state PUT with one entry per attribute, e.g.
+    `[{'success': {'/lights/1/state/on': True}}, {'error': {'type': 201, 'address': '/lights/1/state/bri', ...}}]`.
+    The values in `success` entries are the ones the bridge actually applied, which may differ from the requested ones.
+    Attributes the bridge didn't mention are considered not applied.
+
+    Args:
+        state (dict): The state that was sent
+        response: The response to the PUT
+
+    Returns:
+        (dict, [FailedToSetState]): The applied attributes, and one error per rejected attribute.
+        Errors that aren't about one attribute are plain `FailedToSetState`s
+    """
+    try:
+        results = response.json()
+    except ValueError:
+        results = None
+    if not isinstance(results, list):
+        # Not a result array, nothing tells us an attribute failed
+        return dict(state), []
+    applied = {}
+    errors = []
+    for result in results:
+        if 'success' in result:
+            for address, value in result['success'].items():
+                attribute = address.rstrip('/').rsplit('/', 1)[-1]
+                if attribute in state:
+                    applied[attribute] = value
+        elif 'error' in result:
+            errors.append(FailedToSetAttribute.from_error(result['error']))
+    return applied, errors
+
+
+def raise_state_errors(errors):
+    """
+    Raise the errors of a state change, for `set_state(raise_errors=True)`
+
+    Args:
+        errors ([FailedToSetState]): Errors as returned by `parse_state_results`
+
+    Raises:
+        FailedToSetState: The first error that failed the whole request.
+        `FailedToSetAttributes` when only some attributes were rejected
+    """
+    for error in errors:
+        if not isinstance(error, FailedToSetAttribute):
+            raise error
+    if errors:
+        raise FailedToSetAttributes(errors)
+
+
 class LightState:
     """
     LightState is an internal class that allows you to reactively set the properties on a light.
     Don't use this class directly, instead use the methods on the `HueLight` or `HueGroups` classes.
+
+    A `LightState` that is bound to a light is never modified in place. Setting one of its properties
+    asks the light to update the bridge, and the light then swaps in a new `LightState`.
+    This way a `LightState` read from `HueLight.state` is a consistent snapshot, even while other threads write to the light.
     """
     def __init__(self, state, bind_to=None):
         self.reachable = state.get('reachable')
@@ -17,21 +79,23 @@ class LightState:
 
     @brightness.setter
     def brightness(self, bri):
-        self.__brightness = bri
         if self.light:
             self.light.set_state({'bri': bri})
+        else:
+            self.__brightness = bri
 
     @property
     def color(self):
-        return self.__hue, self.__sat
+        return self.__hue, self.__saturation
 
     @color.setter
     def color(self, color):
         hue, sat = color
-        self.__hue = hue
-        self.__sat = sat
         if self.light:
             self.light.set_state({'hue': hue, 'sat': sat})
+        else:
+            self.__hue = hue
+            self.__saturation = sat
 
     @property
     def hue(self):
@@ -39,9 +103,10 @@ class LightState:
 
     @hue.setter
     def hue(self, hue):
-        self.__hue = hue
         if self.light:
             self.light.set_state({'hue': hue})
+        else:
+            self.__hue = hue
 
     @property
     def saturation(self):
@@ -49,9 +114,10 @@ class LightState:
 
     @saturation.setter
     def saturation(self, sat):
-        self.__saturation = sat
         if self.light:
             self.light.set_state({'sat': sat})
+        else:
+            self.__saturation = sat
 
     @property
     def is_on(self):
@@ -59,9 +125,10 @@ class LightState:
 
     @is_on.setter
     def is_on(self, on):
-        self.__is_on = on
         if self.light:
             self.light.set_state({'on': on})
+        else:
+            self.__is_on = on
 
     def to_payload(self):
         payload = {
@@ -71,3 +138,15 @@ class LightState:
             'on': self.is_on
         }
         return payload
+
+    def updated(self, state):
+        """
+        Return a new `LightState`, bound to the same light, with the values in `state` applied on top of this one.
+
+        Args:
+            state (dict): Partial state, in the bridge's format (`on`, `bri`, `hue`, `sat`)
+        """
+        merged = self.to_payload()
+        merged['reachable'] = self.reachable
+        merged.update(state)
+        return LightState(merged, bind_to=self.light)
@@ -0,0 +1,55 @@
+from collections import namedtuple
+
+
+class SyncPlan(namedtuple('SyncPlan', ['create', 'update', 'delete'])):
+    """
+    Changes needed to bring bridge-side definitions (rules, schedules or sensors) in line with local ones.
+    Returned by the `HueApi.diff_*` and `HueApi.sync_*` methods.
+
+    Attributes
+
+    - `create` (`[definition]`): Local definitions that don't exist on the bridge yet
+    - `update` (`[(definition, dict)]`): Local definitions that differ from the bridge's, with the requests to send, keyed by path relative to the definition's url
+    - `delete` (`[definition]`): Bridge definitions without a local counterpart
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.create or self.update or self.delete)
+
+
+def plan_sync(current, desired, delete_missing=False):
+    """
+    Compare bridge definitions to local ones, matching them by name.
+    The ids of the bridge definitions are copied onto the matching local ones.
+    When several bridge definitions share a name, the first one is matched and the others count as missing,
+    so `delete_missing` removes the duplicates.
+
+    Args:
+        current ([definition]): Definitions as fetched from the bridge
+        desired ([definition]): Local definitions
+        delete_missing (bool, optional): Plan to delete bridge definitions that aren't in `desired`. Defaults to False.
+
+    Returns:
+        SyncPlan: The changes to apply
+    """
+    by_name = {}
+    duplicates = []
+    for definition in current:
+        if definition.name in by_name:
+            duplicates.append(definition)
+        else:
+            by_name[definition.name] = definition
+    create = []
+    update = []
+    for definition in desired:
+        existing = by_name.pop(definition.name, None)
+        if existing is None:
+            create.append(definition)
+            continue
+        definition.id = existing.id
+        updates = definition.updates(existing)
+        if updates:
+            update.append((definition, updates))
+    delete = list(by_name.values()) + duplicates if delete_missing else []
+    return SyncPlan(create, update, delete)
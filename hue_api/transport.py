@@ -0,0 +1,328 @@
+import json
+import select
+import socket
+import threading
+from urllib.parse import urlsplit
+
+import requests as re
+
+
+class RequestsTransport:
+    """
+    Default transport, sends every request through `requests`.
+    """
+
+    def get(self, url):
+        return re.get(url)
+
+    def put(self, url, payload):
+        return re.put(url, json=payload)
+
+    def post(self, url, payload):
+        return re.post(url, json=payload)
+
+    def delete(self, url):
+        return re.delete(url)
+
+    def put_many(self, commands):
+        """
+        Send several PUT requests, in order
+
+        Args:
+            commands ([(str, dict)]): Urls and payloads
+
+        Returns:
+            [response]: One response per command, in the same order
+        """
+        return [self.put(url, payload) for url, payload in commands]
+
+
+class HttpResponse:
+    """
+    Response returned by `HttpTransport`. Mirrors the parts of `requests.Response` that this package uses.
+
+    Attributes
+
+    - `status_code` (`int`): HTTP status code
+    - `headers` (`dict[str, str]`): Response headers, with lowercase names
+    - `content` (`bytes`): Response body
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class ConnectionClosed(Exception):
+    """
+    The bridge closed the connection before it started answering a request
+    """
+    msg = "Connection closed by the bridge"
+
+
+class IncompleteResponse(ConnectionClosed):
+    """
+    The bridge closed the connection in the middle of a response
+    """
+    msg = "Connection closed by the bridge before the end of the response"
+
+
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+
+
+class HttpTransport:
+    """
+    Minimal HTTP/1.1 transport built on the standard library, for the hot `HueLight.set_state` path.
+
+    - Keeps a small pool of persistent connections per bridge. Each request takes an idle connection, or opens
+    a new one when they are all busy, so threads sharing the transport don't wait on each other.
+    Idle connections that the bridge already closed are dropped instead of reused.
+    POST requests always get a new connection, since they can't be sent again if the bridge drops it.
+    - Encodes the request line and headers once per url and method, so a request only adds the body.
+    - `put_many` pipelines several PUTs on one connection: all requests are written before the responses are read.
+    - When the bridge closes a connection before answering, the unanswered GET, PUT and DELETE requests are
+    sent again once on a new connection. POST requests are never sent twice, and nothing is sent again after a timeout.
+
+    Select it with `HueApi(transport=HttpTransport())`.
+
+    Attributes
+
+    - `timeout` (`float`): Socket timeout, in seconds
+    - `max_idle` (`int`): Number of idle connections kept open per bridge
+    """
+
+    def __init__(self, timeout=5.0, max_idle=4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = {}
+        self._heads = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        return self._send([self._encode('GET', url)])[0]
+
+    def put(self, url, payload):
+        return self._send([self._encode('PUT', url, payload)])[0]
+
+    def post(self, url, payload):
+        return self._send([self._encode('POST', url, payload)])[0]
+
+    def delete(self, url):
+        return self._send([self._encode('DELETE', url)])[0]
+
+    def put_many(self, commands):
+        """
+        Pipeline several PUT requests, one connection per bridge
+
+        Args:
+            commands ([(str, dict)]): Urls and payloads
+
+        Returns:
+            [HttpResponse]: One response per command, in the same order
+        """
+        responses = []
+        batch = []
+        for url, payload in commands:
+            request = self._encode('PUT', url, payload)
+            if batch and batch[0][0] != request[0]:
+                responses += self._send(batch)
+                batch = []
+            batch.append(request)
+        if batch:
+            responses += self._send(batch)
+        return responses
+
+    def close(self):
+        """
+        Close every idle connection
+        """
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle = {}
+        for connection in connections:
+            connection.close()
+
+    def _encode(self, method, url, payload=None):
+        # Returns ((host, port), (method, request bytes)). The head is cached per method and url
+        key = (method, url)
+        cached = self._heads.get(key)
+        if cached is None:
+            parts = urlsplit(url)
+            address = (parts.hostname, parts.port or 80)
+            target = parts.path or '/'
+            if parts.query:
+                target += '?' + parts.query
+            head = (f"{method} {target} HTTP/1.1\r\n"
+                    f"Host: {parts.netloc}\r\n"
+                    "Accept: application/json\r\n"
+                    "Content-Type: application/json\r\n"
+                    "Content-Length: ").encode('ascii')
+            cached = self._heads[key] = (address, head)
+        address, head = cached
+        body = b'' if payload is None else json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return address, (method, b''.join((head, str(len(body)).encode('ascii'), b'\r\n\r\n', body)))
+
+    def _send(self, requests):
+        address = requests[0][0]
+        connection = None
+        if all(method in IDEMPOTENT_METHODS for _, (method, _) in requests):
+            connection = self._take_idle(address)
+        if connection is None:
+            connection = _Connection(address, self.timeout)
+        try:
+            responses = connection.exchange([request for _, request in requests])
+        except BaseException:
+            connection.close()
+            raise
+        with self._lock:
+            idle = self._idle.setdefault(address, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                connection = None
+        if connection is not None:
+            connection.close()
+        return responses
+
+    def _take_idle(self, address):
+        # An idle connection that is still open, or None
+        while True:
+            with self._lock:
+                idle = self._idle.get(address)
+                if not idle:
+                    return None
+                connection = idle.pop()
+            if connection.is_open():
+                return connection
+            connection.close()
+
+
+class _Connection:
+    """
+    One persistent connection to a bridge, used by one thread at a time.
+    `exchange` writes a batch of requests, then reads the responses in order.
+    """
+
+    def __init__(self, address, timeout):
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def exchange(self, requests):
+        responses = []
+        retried = False
+        while len(responses) < len(requests):
+            try:
+                if self.sock is None:
+                    self._connect()
+                self.sock.sendall(b''.join(request for _, request in requests[len(responses):]))
+                while len(responses) < len(requests):
+                    response, keep_alive = self._read_response()
+                    responses.append(response)
+                    if not keep_alive:
+                        # The bridge won't answer anything else we pipelined
+                        self._disconnect()
+                        self._check_replayable(requests[len(responses):])
+                        break
+            except (socket.timeout, IncompleteResponse):
+                # The bridge may have acted on the request, sending it again isn't safe
+                self._disconnect()
+                raise
+            except (OSError, ConnectionClosed):
+                # The connection was dropped before the bridge answered
+                self._disconnect()
+                if retried:
+                    raise
+                self._check_replayable(requests[len(responses):])
+                retried = True
+        return responses
+
+    @staticmethod
+    def _check_replayable(requests):
+        if any(method not in IDEMPOTENT_METHODS for method, _ in requests):
+            raise ConnectionClosed
+
+    def is_open(self):
+        """
+        Whether the connection can still be used. An idle connection only becomes readable when the bridge closed it
+        """
+        if self.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        self._disconnect()
+
+    def _connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def _disconnect(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def _read_line(self):
+        line = self.reader.readline(65537)
+        if not line:
+            raise ConnectionClosed
+        return line
+
+    def _read_response(self):
+        status_line = self._read_line()
+        try:
+            return self._read_rest_of_response(status_line)
+        except ConnectionClosed:
+            raise IncompleteResponse
+
+    def _read_rest_of_response(self, status_line):
+        status_line = status_line.decode('latin-1').split(None, 2)
+        status_code = int(status_line[1])
+        headers = {}
+        while True:
+            line = self._read_line()
+            if line in (b'\r\n', b'\n'):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and status_line[0] != 'HTTP/1.0'
+        if status_code < 200 or status_code in (204, 304):
+            content = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = self._read_chunked()
+        elif 'content-length' in headers:
+            content = self._read_exactly(int(headers['content-length']))
+        else:
+            content = self.reader.read()
+            keep_alive = False
+        return HttpResponse(status_code, headers, content), keep_alive
+
+    def _read_exactly(self, length):
+        content = self.reader.read(length)
+        if len(content) < length:
+            raise ConnectionClosed
+        return content
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self._read_line().split(b';')[0].strip(), 16)
+            if size == 0:
+                break
+            chunks.append(self._read_exactly(size))
+            self._read_line()
+        while self._read_line() not in (b'\r\n', b'\n'):
+            pass
+        return b''.join(chunks)
@@ -1,26 +1,51 @@
+import json
 import pickle
 import os
+import socket
+import threading
+import time
 import requests
 
 import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 
 from hue_api import HueApi
 from hue_api.lights import HueLight
 from hue_api.groups import HueGroup
+from hue_api.rules import HueRule, Condition, Action
+from hue_api.schedules import HueSchedule
+from hue_api.sensors import HueSensor
+from hue_api.recorder import StateRecorder
+from hue_api.transport import HttpTransport
+from hue_api import discovery
+from hue_api.shared import (SharedStatePublisher, SharedStateReader, SEQUENCE, SEQUENCE_OFFSET,
+                            LIGHTS_TRUNCATED, GROUPS_TRUNCATED)
 from hue_api.exceptions import (UninitializedException,
                                 DevicetypeException,
-                                ButtonNotPressedException)
+                                ButtonNotPressedException,
+                                FailedToSetState,
+                                FailedToSetAttributes,
+                                InvalidAttributeValue,
+                                DeviceIsOff,
+                                FailedToReadSharedState)
 
 
+class SuccessResponse:
+    """Bridge response to a state PUT where every attribute was applied"""
+    status_code = 200
+
+    def __init__(self, url, state):
+        self.results = [{'success': {url + key: value}} for key, value in state.items()]
+
+    def json(self):
+        return self.results
+
 @pytest.fixture
 def put_nothing(monkeypatch):
     """Requests.put() mocked to succeed and nothing else"""
 
-    class MockResponse:
-        status_code = 200
-
     def mock_put(*args, **kwargs):
-        return MockResponse()
+        return SuccessResponse(args[0], kwargs['json'])
     monkeypatch.setattr(requests, "put", mock_put)
 
 def test_defaults_dont_crash():
@@ -268,3 +293,789 @@ def test_set_color(put_nothing):
     api.set_color('green')
     assert light.state.hue == 21845
     assert light.state.saturation == 255
+
+def test_snapshot_restore(monkeypatch):
+    sent = []
+
+    def mock_put(*args, **kwargs):
+        sent.append((args[0], kwargs['json']))
+        return SuccessResponse(args[0], kwargs['json'])
+
+    monkeypatch.setattr(requests, 'put', mock_put)
+    test_url = 'http://test.com'
+    api = HueApi()
+    api.base_url = test_url
+    api.lights = [
+        HueLight(1, 'Light 1', {'on': True, 'bri': 100}, test_url + '/lights'),
+        HueLight(2, 'Light 2', {'on': True, 'bri': 100}, test_url + '/lights'),
+        HueLight(3, 'Light 3', {'on': False, 'bri': 50, 'hue': 100, 'sat': 0}, test_url + '/lights'),
+    ]
+    api.groups = [HueGroup('4', 'Group', api.lights[:2], test_url + '/groups')]
+    snapshot = api.snapshot()
+    assert len(snapshot) == 3
+    assert snapshot == api.snapshot()
+    assert snapshot.state_for(3) == {'on': False, 'bri': 50, 'hue': 100, 'sat': 0}
+    with pytest.raises(AttributeError):
+        snapshot.extra = True
+
+    assert api.restore(snapshot) == []
+    api.turn_on([3])
+    api.set_brightness(254)
+    api.set_color('red', [3])
+    sent.clear()
+
+    api.restore(snapshot)
+    assert sent == [
+        (test_url + '/groups/4/action/', {'bri': 100}),
+        (test_url + '/lights/3/state/', {'on': False, 'bri': 50, 'hue': 100, 'sat': 0}),
+    ]
+    assert api.snapshot() == snapshot
+
+    # Lights already off are left alone
+    api.set_brightness(254, [1, 2])
+    sent.clear()
+    api.restore(snapshot)
+    assert sent == [(test_url + '/groups/4/action/', {'bri': 100})]
+
+def test_concurrent_writes(monkeypatch):
+    def mock_put(*args, **kwargs):
+        time.sleep(0.001)
+        return SuccessResponse(args[0], kwargs['json'])
+
+    monkeypatch.setattr(requests, 'put', mock_put)
+    light = HueLight(1, 'Light 1', {'on': False, 'bri': 1}, None)
+    seen = []
+
+    def toggle():
+        for _ in range(10):
+            light.toggle_on()
+
+    def read():
+        for _ in range(100):
+            state = light.state
+            seen.append((state.is_on, state.brightness))
+
+    threads = [threading.Thread(target=toggle) for _ in range(4)]
+    threads.append(threading.Thread(target=read))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not light.state.is_on
+    assert set(seen) <= {(False, 1), (True, 1)}
+
+def test_concurrent_group_and_light_writes(monkeypatch):
+    bridge = {1: {}, 2: {}}
+    bridge_lock = threading.Lock()
+    group_sent = threading.Event()
+
+    def mock_put(*args, **kwargs):
+        url, payload = args[0], kwargs['json']
+        with bridge_lock:
+            if '/groups/' in url:
+                for state in bridge.values():
+                    state.update(payload)
+            else:
+                bridge[int(url.split('/')[-3])].update(payload)
+        if '/groups/' in url:
+            # Slow group response, single light writes get a chance to run in the meantime
+            group_sent.set()
+            time.sleep(0.01)
+        return SuccessResponse(url, payload)
+
+    monkeypatch.setattr(requests, 'put', mock_put)
+    lights = [HueLight(id, f'Light {id}', {'on': True, 'bri': 1}, 'http://test.com/lights') for id in (1, 2)]
+    group = HueGroup('1', 'Group', lights, 'http://test.com/groups')
+
+    thread = threading.Thread(target=group.set_state, args=({'bri': 100},))
+    thread.start()
+    group_sent.wait()
+    lights[1].set_state({'bri': 200})
+    thread.join()
+    assert bridge[2]['bri'] == 200
+    assert lights[1].state.brightness == 200
+
+    def write_group():
+        for bri in range(100, 110):
+            group.set_state({'bri': bri})
+
+    def write_light(light):
+        for bri in range(200, 210):
+            light.set_state({'bri': bri})
+
+    threads = [threading.Thread(target=write_group) for _ in range(2)]
+    threads += [threading.Thread(target=write_light, args=(light,)) for light in lights]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for light in lights:
+        assert light.state.brightness == bridge[light.id]['bri']
+
+def test_sync_rules(monkeypatch):
+    test_url = 'http://test.com'
+    bridge_rules = {
+        '1': {
+            'name': 'motion',
+            'owner': 'test_user_name',
+            'conditions': [{'address': '/sensors/2/state/presence', 'operator': 'eq', 'value': 'true'}],
+            'actions': [{'address': '/groups/1/action', 'method': 'PUT', 'body': {'on': True}}],
+            'status': 'enabled'
+        },
+        '2': {
+            'name': 'old',
+            'conditions': [],
+            'actions': [],
+            'status': 'enabled'
+        }
+    }
+    sent = []
+
+    class MockResponse:
+        status_code = 200
+
+        def __init__(self, data):
+            self.data = data
+
+        def json(self):
+            return self.data
+
+    def mock_get(*args, **kwargs):
+        assert args[0] == test_url + '/rules'
+        return MockResponse(bridge_rules)
+
+    def mock_post(*args, **kwargs):
+        sent.append(('POST', args[0], kwargs['json']))
+        bridge_rules['3'] = kwargs['json']
+        return MockResponse([{'success': {'id': '3'}}])
+
+    def mock_put(*args, **kwargs):
+        sent.append(('PUT', args[0], kwargs['json']))
+        bridge_rules[args[0].split('/')[-1]].update(kwargs['json'])
+        return MockResponse([{'success': {}}])
+
+    monkeypatch.setattr(requests, 'get', mock_get)
+    monkeypatch.setattr(requests, 'post', mock_post)
+    monkeypatch.setattr(requests, 'put', mock_put)
+    api = HueApi()
+    api.base_url = test_url
+    motion = HueRule('motion',
+                     [Condition('/sensors/2/state/presence', 'eq', 'true')],
+                     [Action('/groups/1/action', 'PUT', {'on': True})],
+                     status='disabled')
+    timer = HueRule('timer',
+                    [Condition('/sensors/2/state/presence', 'stable')],
+                    [Action('/groups/1/action', 'PUT', {'on': False})])
+
+    plan = api.sync_rules([motion, timer])
+    assert plan.create == [timer]
+    assert plan.update == [(motion, {'': motion.to_payload()})]
+    assert plan.delete == []
+    assert [(method, url) for method, url, _ in sent] == [
+        ('POST', test_url + '/rules'),
+        ('PUT', test_url + '/rules/1'),
+    ]
+    assert motion.id == '1'
+    assert timer.id == '3'
+
+    sent.clear()
+    assert not api.sync_rules([motion, timer])
+    assert sent == []
+    assert [rule.name for rule in api.diff_rules([motion], delete_missing=True).delete] == ['old', 'timer']
+
+@pytest.fixture
+def fake_bridge(monkeypatch):
+    """Requests mocked to serve and modify bridge resources, keyed by url. Sent requests are recorded"""
+
+    class FakeBridge:
+        url = 'http://test.com'
+
+        def __init__(self):
+            self.resources = {}
+            self.sent = []
+
+        def get(self, url, **kwargs):
+            return self.Response(self.resources[url[len(self.url) + 1:]])
+
+        def post(self, url, json=None, **kwargs):
+            self.sent.append(('POST', url, json))
+            resource = self.resources[url[len(self.url) + 1:]]
+            id = str(len(resource) + 1)
+            resource[id] = json
+            return self.Response([{'success': {'id': id}}])
+
+        def put(self, url, json=None, **kwargs):
+            self.sent.append(('PUT', url, json))
+            path = url[len(self.url) + 1:].split('/')
+            target = self.resources[path[0]][path[1]]
+            if len(path) > 2:
+                target = target.setdefault(path[2], {})
+            target.update(json)
+            return self.Response([{'success': {url: value}} for url, value in json.items()])
+
+        def delete(self, url, **kwargs):
+            self.sent.append(('DELETE', url, None))
+            path = url[len(self.url) + 1:].split('/')
+            del self.resources[path[0]][path[1]]
+            return self.Response([{'success': url}])
+
+        class Response:
+            status_code = 200
+
+            def __init__(self, data):
+                self.data = data
+
+            def json(self):
+                return self.data
+
+    bridge = FakeBridge()
+    for method in ('get', 'post', 'put', 'delete'):
+        monkeypatch.setattr(requests, method, getattr(bridge, method))
+    return bridge
+
+def test_sync_schedules(fake_bridge):
+    command = Action('/api/test_user_name/groups/1/action', 'PUT', {'on': True})
+    fake_bridge.resources['schedules'] = {
+        '1': {
+            'name': 'wake up',
+            'description': '',
+            'command': command.to_dict(),
+            'localtime': 'W124/T07:00:00',
+            'status': 'enabled',
+            'created': '2020-01-01T00:00:00'
+        }
+    }
+    api = HueApi()
+    api.base_url = fake_bridge.url
+    wake_up = HueSchedule('wake up', command, 'W124/T07:30:00')
+    sleep = HueSchedule('sleep', Action('/api/test_user_name/groups/1/action', 'PUT', {'on': False}),
+                        'W127/T23:00:00', autodelete=False)
+    assert wake_up.updates(HueSchedule.from_dict('1', fake_bridge.resources['schedules']['1'])) == {
+        '': {'localtime': 'W124/T07:30:00'}
+    }
+
+    plan = api.sync_schedules([wake_up, sleep])
+    assert plan.create == [sleep]
+    assert fake_bridge.sent == [
+        ('POST', fake_bridge.url + '/schedules', sleep.to_payload()),
+        ('PUT', fake_bridge.url + '/schedules/1', {'localtime': 'W124/T07:30:00'}),
+    ]
+    assert (wake_up.id, sleep.id) == ('1', '2')
+
+    fake_bridge.sent.clear()
+    assert not api.sync_schedules([wake_up, sleep])
+    assert fake_bridge.sent == []
+
+def test_sync_sensors(fake_bridge):
+    fake_bridge.resources['sensors'] = {
+        '1': {
+            'name': 'Hallway motion',
+            'type': 'ZLLPresence',
+            'modelid': 'SML001',
+            'manufacturername': 'Philips',
+            'swversion': '6.1.1.27575',
+            'uniqueid': '00:17:88:01:02:00:00:00-02-0406',
+            'state': {'presence': False},
+            'config': {'on': True, 'sensitivity': 2}
+        }
+    }
+    api = HueApi()
+    api.base_url = fake_bridge.url
+    motion = HueSensor('Hall motion', 'ZLLPresence', 'SML001', 'Philips', '6.1.1.27575',
+                       '00:17:88:01:02:00:00:00-02-0406', config={'sensitivity': 1})
+    status = HueSensor('Away', 'CLIPGenericStatus', 'status', 'hue_py', '1.0', 'away-status',
+                       state={'status': 0})
+    motion_on_bridge = HueSensor.from_dict('1', fake_bridge.resources['sensors']['1'])
+    motion.name = 'Hallway motion'
+    assert motion.updates(motion_on_bridge) == {'config': {'sensitivity': 1}}
+    motion.name = 'Hall motion'
+    assert motion.updates(motion_on_bridge) == {'': {'name': 'Hall motion'}, 'config': {'sensitivity': 1}}
+
+    # Sensors are matched by name, so a renamed sensor shows up as new
+    motion.name = 'Hallway motion'
+    plan = api.sync_sensors([motion, status])
+    assert plan.create == [status]
+    assert fake_bridge.sent == [
+        ('POST', fake_bridge.url + '/sensors', status.to_payload()),
+        ('PUT', fake_bridge.url + '/sensors/1/config', {'sensitivity': 1}),
+    ]
+
+    fake_bridge.sent.clear()
+    assert not api.sync_sensors([motion, status])
+    assert fake_bridge.sent == []
+
+def test_sync_deletes_duplicates(fake_bridge):
+    rule = {'name': 'motion', 'conditions': [], 'actions': [], 'status': 'enabled'}
+    fake_bridge.resources['rules'] = {'1': dict(rule), '2': dict(rule)}
+    api = HueApi()
+    api.base_url = fake_bridge.url
+    motion = HueRule('motion', [], [])
+    assert not api.sync_rules([motion])
+    plan = api.sync_rules([motion], delete_missing=True)
+    assert [rule.id for rule in plan.delete] == ['2']
+    assert list(fake_bridge.resources['rules']) == ['1']
+
+def test_state_recorder(monkeypatch, tmp_path):
+    bridge_lights = {'1': {'name': 'Light 1', 'state': {'on': False, 'bri': 10, 'reachable': True}}}
+
+    class MockResponse:
+        def json(self):
+            return bridge_lights
+
+    monkeypatch.setattr(requests, 'get', lambda *args, **kwargs: MockResponse())
+    api = HueApi()
+    api.base_url = 'http://test.com'
+    recorder = StateRecorder(capacity=3)
+    recorder.attach(api)
+    clock = iter([1.0, 2.0, 3.0, 4.0, 5.0])
+    monkeypatch.setattr(time, 'time', lambda: next(clock))
+    api.fetch_lights()
+    api.fetch_lights()
+    bridge_lights['1']['state'] = {'on': True, 'bri': 20, 'reachable': True}
+    api.fetch_lights()
+    bridge_lights['1']['state'] = {'on': True, 'bri': 30, 'reachable': True}
+    api.fetch_lights()
+    bridge_lights['1']['state'] = {'on': True, 'bri': 40, 'reachable': True}
+    api.fetch_lights()
+
+    assert recorder.samples(1, 'on') == [(1.0, False), (3.0, True)]
+    assert recorder.samples(1, 'reachable') == [(1.0, True)]
+    assert recorder.samples(1, 'hue') == [(1.0, None)]
+    assert recorder.samples(1, 'bri') == [(3.0, 20), (4.0, 30), (5.0, 40)]
+    assert recorder.samples(1, 'bri', 3.5, 4.5) == [(3.0, 20), (4.0, 30)]
+    assert recorder.value_at(1, 'on', 2.5) is False
+    assert recorder.value_at(1, 'bri', 0.5) is None
+
+    binary_file = str(tmp_path / 'history.bin')
+    recorder.export_binary(binary_file)
+    assert (1, 'bri', 4.0, 30) in StateRecorder.read_binary(binary_file)
+    csv_file = str(tmp_path / 'history.csv')
+    recorder.export_csv(csv_file, start=4.0)
+    with open(csv_file) as exported:
+        lines = exported.read().splitlines()
+    assert lines[0] == 'light_id,attribute,timestamp,value'
+    assert '1,bri,4.0,30' in lines
+    assert '1,bri,3.0,20' not in lines
+
+@pytest.fixture
+def bridge_server():
+    """Local stand-in for the bridge that echoes state PUTs as success entries"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        wbufsize = -1
+        connections = []
+
+        def setup(self):
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Handler.connections.append(self.client_address)
+
+        def do_PUT(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            result = [{'success': {self.path + key: value}} for key, value in body.items()]
+            self.reply(result)
+
+        def do_GET(self):
+            self.reply({'1': {'name': 'Light 1', 'state': {'on': True}}})
+
+        def reply(self, data):
+            content = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_http_transport(bridge_server):
+    test_url = 'http://127.0.0.1:%d/api/test_user_name' % bridge_server.server_port
+    transport = HttpTransport()
+    api = HueApi(transport=transport)
+    api.base_url = test_url
+    api.fetch_lights()
+    assert api.lights[0].state.is_on
+    api.lights.append(HueLight(2, 'Light 2', {'on': True}, test_url + '/lights', transport))
+
+    responses = transport.put_many([(light.state_url, {'bri': 10 * light.id}) for light in api.lights])
+    assert [response.json() for response in responses] == [
+        [{'success': {'/api/test_user_name/lights/1/state/bri': 10}}],
+        [{'success': {'/api/test_user_name/lights/2/state/bri': 20}}],
+    ]
+    api.turn_off()
+    assert not any(light.state.is_on for light in api.lights)
+    assert len(bridge_server.RequestHandlerClass.connections) == 1
+    transport.close()
+
+@pytest.fixture
+def slow_bridge():
+    """Local stand-in for the bridge where GETs and POSTs take 0.5s to answer. Requests are counted by method"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        wbufsize = -1
+        received = []
+
+        def do_GET(self):
+            self.received.append('GET')
+            time.sleep(0.5)
+            self.reply({})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.received.append('POST')
+            time.sleep(0.5)
+            self.reply([{'success': {'id': '1'}}])
+
+        def do_PUT(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.received.append('PUT')
+            self.reply([])
+
+        def reply(self, data):
+            content = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_http_transport_never_replays_post(slow_bridge):
+    url = 'http://127.0.0.1:%d/api/test_user_name/rules' % slow_bridge.server_port
+    transport = HttpTransport(timeout=0.2)
+    with pytest.raises(socket.timeout):
+        transport.post(url, {'name': 'rule'})
+    time.sleep(0.5)
+    assert slow_bridge.RequestHandlerClass.received == ['POST']
+    transport.close()
+
+@pytest.fixture
+def idle_closing_bridge():
+    """Local stand-in for the bridge that closes connections idle for more than 0.2s. The link button is pressed
+    after the first pairing attempt. Requests are counted by method, connections by client address"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        wbufsize = -1
+        timeout = 0.2
+        received = []
+        connections = []
+
+        def setup(self):
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Handler.connections.append(self.client_address)
+
+        def do_GET(self):
+            self.received.append('GET')
+            self.reply({})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.received.append('POST')
+            if self.received.count('POST') == 1:
+                self.reply([{'error': {'type': 101, 'address': '', 'description': 'link button not pressed'}}])
+            else:
+                self.reply([{'success': {'username': 'test_user_name'}}])
+
+        def do_PUT(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.received.append('PUT')
+            self.reply([])
+
+        def reply(self, data):
+            content = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_http_transport_after_idle_close(idle_closing_bridge):
+    address = '127.0.0.1:%d' % idle_closing_bridge.server_port
+    transport = HttpTransport()
+    api = HueApi(transport=transport)
+    transport.get(f'http://{address}/api/test_user_name/lights')
+    time.sleep(0.5)
+    # The retry is sent after the bridge dropped the connection of the first attempt
+    api.pair(address, timeout=5.0, interval=0.5)
+    assert api.user_name == 'test_user_name'
+
+    time.sleep(0.5)
+    transport.put(f'http://{address}/api/test_user_name/lights/1/state', {'on': True})
+    handler = idle_closing_bridge.RequestHandlerClass
+    assert handler.received == ['GET', 'POST', 'POST', 'PUT']
+    assert len(handler.connections) == 4
+    transport.close()
+
+def test_http_transport_pools_connections(slow_bridge):
+    url = 'http://127.0.0.1:%d/api/test_user_name' % slow_bridge.server_port
+    transport = HttpTransport()
+    reader = threading.Thread(target=transport.get, args=(url + '/lights',))
+    reader.start()
+    while not slow_bridge.RequestHandlerClass.received:
+        time.sleep(0.01)
+    start = time.monotonic()
+    transport.put(url + '/lights/1/state', {'on': True})
+    assert time.monotonic() - start < 0.3
+    reader.join()
+    transport.close()
+
+def discovery_responder(reply, host='127.0.0.1', count=1):
+    """Local stand-in for a bridge answering `count` discovery probes with `reply(probe)`"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, 0))
+
+    def serve():
+        for _ in range(count):
+            data, address = sock.recvfrom(65535)
+            sock.sendto(reply(data), address)
+        sock.close()
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()
+
+def ssdp_reply(data):
+    assert data.startswith(b'M-SEARCH')
+    return b'HTTP/1.1 200 OK\r\nSERVER: Linux/3.14.0 UPnP/1.0 IpBridge/1.41.0\r\n\r\n'
+
+def mdns_reply(data):
+    assert data == discovery.mdns_query()
+    return b'\x00\x00\x84\x00' + data[4:]
+
+def test_discover_bridges():
+    responder = discovery_responder
+    discovery.clear_cache()
+    ssdp_address = responder(ssdp_reply)
+    mdns_address = responder(mdns_reply)
+    start = time.monotonic()
+    bridges = discovery.discover_bridges(timeout=1, ssdp_address=ssdp_address, mdns_address=mdns_address)
+    assert bridges == ['127.0.0.1']
+    assert time.monotonic() - start < 1.5
+
+    # Cached: nothing answers anymore
+    assert discovery.discover_bridges(ssdp_address=ssdp_address, mdns_address=mdns_address) == ['127.0.0.1']
+    discovery.clear_cache()
+    assert discovery.discover_bridges(timeout=0.3, ssdp_address=ssdp_address, mdns_address=mdns_address) == []
+
+def test_discover_bridges_limit_is_not_cached():
+    discovery.clear_cache()
+    ssdp_address = discovery_responder(ssdp_reply, '127.0.0.1', count=2)
+    mdns_address = discovery_responder(mdns_reply, '127.0.0.2', count=2)
+    addresses = {'ssdp_address': ssdp_address, 'mdns_address': mdns_address}
+    first = discovery.discover_bridges(timeout=1, limit=1, **addresses)
+    assert len(first) == 1
+    assert sorted(discovery.discover_bridges(timeout=0.5, **addresses)) == ['127.0.0.1', '127.0.0.2']
+
+    # A complete search is served from the cache, also to callers with a limit
+    assert len(discovery.discover_bridges(limit=1, **addresses)) == 1
+    assert len(discovery.discover_bridges(**addresses)) == 2
+    discovery.clear_cache()
+
+def test_pair(monkeypatch):
+    attempts = []
+    delays = []
+
+    class MockResponse:
+        def json(self):
+            if len(attempts) < 4:
+                return [{'error': {'type': 101}}]
+            return [{'success': {'username': 'test_user_name'}}]
+
+    def mock_post(*args, **kwargs):
+        attempts.append(args[0])
+        return MockResponse()
+
+    monkeypatch.setattr(requests, 'post', mock_post)
+    monkeypatch.setattr(time, 'sleep', delays.append)
+    api = HueApi()
+    api.pair('test_address', interval=1, max_interval=3)
+    assert api.user_name == 'test_user_name'
+    assert delays == [1, 2, 3]
+
+    attempts.clear()
+    with pytest.raises(ButtonNotPressedException):
+        api.pair('test_address', timeout=0)
+
+def test_shared_state(tmp_path, fake_bridge):
+    path = str(tmp_path / 'hue_state')
+    api = HueApi()
+    api.base_url = fake_bridge.url
+    publisher = SharedStatePublisher(path, max_lights=2, max_groups=1)
+    publisher.attach(api)
+    reader = SharedStateReader(path)
+    assert reader.lights() == []
+
+    fake_bridge.resources['lights'] = {
+        '1': {'name': 'Light 1', 'state': {'on': True, 'bri': 254, 'hue': 65535, 'sat': 0, 'reachable': True}},
+        '2': {'name': 'Light 2', 'state': {}},
+    }
+    fake_bridge.resources['groups'] = {'3': {'name': 'Group', 'lights': ['1', '2']}}
+    api.fetch_lights()
+    api.fetch_groups()
+    state = reader.read()
+    assert state.sequence % 2 == 0
+    assert state.lights[0] == (1, 'Light 1', True, True, 254, 65535, 0)
+    assert state.lights[1] == (2, 'Light 2', None, None, None, None, None)
+    assert state.groups == [('3', 'Group', [1, 2])]
+    assert state.truncated == 0
+    assert reader.read() is state
+
+    # More groups than the file has room for: fetching still works, the overflow is flagged
+    fake_bridge.resources['groups']['4'] = {'name': 'Other group', 'lights': ['1']}
+    assert len(api.fetch_groups()) == 2
+    state = reader.read()
+    assert state.groups == [('3', 'Group', [1, 2])]
+    assert state.truncated == GROUPS_TRUNCATED
+
+    fake_bridge.resources['lights']['3'] = {'name': 'Light 3', 'state': {}}
+    api.fetch_lights()
+    assert [light.id for light in reader.lights()] == [1, 2]
+    assert reader.read().truncated == LIGHTS_TRUNCATED | GROUPS_TRUNCATED
+    reader.close()
+    publisher.close()
+
+def test_shared_state_read_gives_up(tmp_path):
+    path = str(tmp_path / 'hue_state')
+    publisher = SharedStatePublisher(path)
+    reader = SharedStateReader(path)
+    state = reader.read()
+
+    # A publisher that died in the middle of a write leaves the sequence odd
+    sequence = reader.sequence
+    SEQUENCE.pack_into(publisher._map, SEQUENCE_OFFSET, sequence + 1)
+    assert reader.read(timeout=0.01) is state
+    with pytest.raises(FailedToReadSharedState):
+        SharedStateReader(path).read(timeout=0.01)
+
+    SEQUENCE.pack_into(publisher._map, SEQUENCE_OFFSET, sequence + 2)
+    assert reader.read().sequence == sequence + 2
+    reader.close()
+    publisher.close()
+
+def test_single_flight_fetch(monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    class MockResponse:
+        def json(self):
+            return {'1': {'name': 'Light 1', 'state': {}}}
+
+    def mock_get(*args, **kwargs):
+        calls.append(args[0])
+        release.wait(1)
+        return MockResponse()
+
+    monkeypatch.setattr(requests, 'get', mock_get)
+    api = HueApi(min_freshness_ms=60000)
+    api.base_url = 'http://test.com'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(api.fetch_lights())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(result is results[0] for result in results)
+
+    assert api.fetch_lights() is results[0]
+    assert len(calls) == 1
+    api.min_freshness_ms = 0
+    assert api.fetch_lights() is not results[0]
+    assert len(calls) == 2
+
+def test_set_state_partial_failure(monkeypatch):
+    class MockResponse:
+        status_code = 200
+
+        def json(self):
+            return [
+                {'success': {'/lights/1/state/hue': 1000}},
+                {'error': {'type': 201, 'address': '/lights/1/state/bri',
+                           'description': 'parameter, bri, is not modifiable. Device is set to off.'}},
+            ]
+
+    monkeypatch.setattr(requests, 'put', lambda *args, **kwargs: MockResponse())
+    light = HueLight(1, 'Light 1', {'on': False, 'bri': 1, 'hue': 0}, 'http://test.com/lights')
+    errors = light.set_state({'bri': 100, 'hue': 999})
+    assert len(errors) == 1
+    assert isinstance(errors[0], DeviceIsOff)
+    assert errors[0].attribute == 'bri'
+    assert light.state.brightness == 1
+    assert light.state.hue == 1000
+
+    with pytest.raises(FailedToSetAttributes) as raised:
+        light.set_state({'bri': 100, 'hue': 1000}, raise_errors=True)
+    assert [error.attribute for error in raised.value.errors] == ['bri']
+
+def test_set_state_request_failure(monkeypatch):
+    results = []
+
+    class MockResponse:
+        status_code = 200
+
+        def json(self):
+            return results
+
+    monkeypatch.setattr(requests, 'put', lambda *args, **kwargs: MockResponse())
+    results[:] = [{'error': {'type': 3, 'address': '/lights/99/state',
+                             'description': 'resource, /lights/99/state, not available'}}]
+    light = HueLight(99, 'Light 99', {'on': True, 'bri': 1}, 'http://test.com/lights')
+    errors = light.set_state({'bri': 100})
+    assert len(errors) == 1
+    assert type(errors[0]) is FailedToSetState
+    assert errors[0].type == 3
+    assert errors[0].description == 'resource, /lights/99/state, not available'
+    assert 'not available' in errors[0].msg
+    assert light.state.brightness == 1
+
+    results[:] = [{'error': {'type': 1, 'address': '/', 'description': 'unauthorized user'}}]
+    with pytest.raises(FailedToSetState) as raised:
+        light.set_state({'bri': 100}, raise_errors=True)
+    assert type(raised.value) is FailedToSetState
+    assert raised.value.type == 1
+
+    # Groups report attribute errors at .../action/<attribute>
+    group = HueGroup('1', 'Group', [light], 'http://test.com/groups')
+    results[:] = [
+        {'success': {'/groups/1/action/on': True}},
+        {'error': {'type': 7, 'address': '/groups/1/action/bri', 'description': 'invalid value'}},
+    ]
+    with pytest.raises(FailedToSetAttributes) as raised:
+        group.set_state({'on': True, 'bri': 1000}, raise_errors=True)
+    assert isinstance(raised.value.errors[0], InvalidAttributeValue)
+    assert raised.value.errors[0].attribute == 'bri'
+    assert light.state.is_on is True